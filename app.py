@@ -1,11 +1,25 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore import FieldFilter
+from google.api_core.exceptions import NotFound
+from google.protobuf.timestamp_pb2 import Timestamp
 from flask import Flask, request, jsonify, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from datetime import datetime, timezone
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+import logging
 import os
+import re
+import threading
+import orjson
+from cachetools import TTLCache
 
 # Security imports
 from config.security import (
@@ -23,6 +37,7 @@ from core.recommender import ContentBasedRecommender
 from core.user_manager import UserManager
 from core.safety_validator import SafetyValidator
 from core.simple_memory import SimpleMemory
+from core.journey_logger import JourneyLogger
 
 # Helpers
 from core.response_formatter import (
@@ -33,11 +48,14 @@ from core.response_formatter import (
     format_nutrition_report,
     format_workout_history
 )
-from core.calculator import calculate_bmi, calculate_target_calories
+from core.calculator import calculate_target_calories
 
-# --- FIREBASE INIT ---
-import json
+# --- LOGGING ---
+# force=True: core.user_manager calls basicConfig(INFO) at import; LOG_LEVEL decides for the whole app
+logging.basicConfig(level=Config.LOG_LEVEL, force=True)
+logger = logging.getLogger(__name__)
 
+# --- FIREBASE INIT ---
 if not firebase_admin._apps:
     key_path = Config.FIREBASE_CREDENTIALS if hasattr(Config, 'FIREBASE_CREDENTIALS') else 'serviceAccountKey.json'
     
@@ -45,23 +63,38 @@ if not firebase_admin._apps:
     firebase_json = os.getenv('FIREBASE_SERVICE_ACCOUNT_JSON')
     if firebase_json:
         try:
-            service_account_info = json.loads(firebase_json)
+            service_account_info = orjson.loads(firebase_json)
             cred = credentials.Certificate(service_account_info)
             firebase_admin.initialize_app(cred)
-            print("Firebase initialized from environment variable.")
-        except json.JSONDecodeError as e:
-            print(f"Error parsing FIREBASE_SERVICE_ACCOUNT_JSON: {e}")
+            logger.info("Firebase initialized from environment variable.")
+        except orjson.JSONDecodeError as e:
+            logger.error("Error parsing FIREBASE_SERVICE_ACCOUNT_JSON: %s", e)
     # Option 2: Load from file (local/Render deployment)
     elif os.path.exists(key_path):
         cred = credentials.Certificate(key_path)
         firebase_admin.initialize_app(cred)
-        print("Firebase initialized from serviceAccountKey.json file.")
+        logger.info("Firebase initialized from serviceAccountKey.json file.")
     else:
-        print("Warning: No Firebase credentials found. Set FIREBASE_SERVICE_ACCOUNT_JSON env var or provide serviceAccountKey.json")
+        logger.warning("No Firebase credentials found. Set FIREBASE_SERVICE_ACCOUNT_JSON env var or provide serviceAccountKey.json")
 
+# Single Firestore client (one gRPC channel) shared by every engine and endpoint in this process
 db_client = firestore.client() if firebase_admin._apps else None
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serializes jsonify() responses with orjson (chat replies carry multi-KB HTML strings)."""
+
+    options = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.secret_key = SecurityConfig.SECRET_KEY
 
 # CORS Configuration - allow frontend from different domain (Render)
@@ -78,7 +111,8 @@ limiter = Limiter(
     key_func=get_remote_address,
     app=app,
     default_limits=[SecurityConfig.RATE_LIMIT_DEFAULT],
-    storage_uri="memory://"
+    storage_uri=SecurityConfig.RATE_LIMIT_STORAGE_URI,
+    strategy=SecurityConfig.RATE_LIMIT_STRATEGY
 )
 
 # Add security headers to all responses
@@ -88,22 +122,298 @@ def after_request(response):
 
 # --- ENGINE INIT ---
 nlu = SmartNLUEngine()
-recommender = ContentBasedRecommender()
-# UserManager expects key_path, not db_client - let it initialize its own connection
-key_path = Config.FIREBASE_CREDENTIALS if hasattr(Config, 'FIREBASE_CREDENTIALS') else 'serviceAccountKey.json'
-user_manager = UserManager(key_path)
+recommender = ContentBasedRecommender(db_client)
+user_manager = UserManager(db_client=db_client, redis_url=Config.REDIS_URL)
+journey_logger = JourneyLogger(db_client)
+memory = SimpleMemory(db_client)
+
+# Profile fields read on the chat hot path (NLU context, safety checks, recommender, progress)
+CHAT_PROFILE_FIELDS = (
+    'name', 'age', 'gender', 'weight', 'height', 'bmi',
+    'goal', 'fitness_level', 'medical_conditions'
+)
+
+# Health-related intents that require a complete profile and pass the safety check
+HEALTH_INTENTS = frozenset({
+    'fitness_request', 'fitness_variation',
+    'nutrition_request', 'nutrition_variation',
+    'explain_exercise', 'nutrition_recipe'
+})
+
+# Progress tracking intents (don't require full profile)
+PROGRESS_INTENTS = frozenset({'log_weight', 'log_nutrition', 'log_workout', 'view_progress'})
+
+# Recommendation intents: a new request resets the target and seen items, a variation reuses them
+FITNESS_INTENTS = frozenset({'fitness_request', 'fitness_variation'})
+NUTRITION_INTENTS = frozenset({'nutrition_request', 'nutrition_variation'})
+NEW_REQUEST_INTENTS = frozenset({'fitness_request', 'nutrition_request'})
+VARIATION_INTENTS = frozenset({'fitness_variation', 'nutrition_variation'})
+
+# Chat turns kept in the session (bounded deque; the NLU reads the last 3)
+MAX_HISTORY = 6
+
+# Recently shown items kept in the session to avoid repeats (older ones fall back to SimpleMemory)
+MAX_SEEN_TITLES = 50
+
+# Shared pool for overlapping independent Firestore round-trips within a request
+executor = ThreadPoolExecutor(max_workers=8)
+
+# Titles of conversations already past 'New Chat', so later user messages skip the title read
+conversation_title_cache = TTLCache(maxsize=10_000, ttl=3600)
+conversation_title_lock = threading.Lock()
+
+
+@lru_cache(maxsize=2048)
+def user_conversations(user_id):
+    """users/{user_id}/conversations reference, reused across requests."""
+    return db_client.collection('users').document(user_id).collection('conversations')
+
+
+@lru_cache(maxsize=1024)
+def recent_conversations_query(user_id):
+    """Sidebar listing query; Firestore queries are immutable, so one per user is reused."""
+    # Projection: the listing never downloads the messages arrays
+    return user_conversations(user_id) \
+        .select(['title', 'updated_at', 'message_count']) \
+        .order_by('updated_at', direction=firestore.Query.DESCENDING) \
+        .limit(20)
+
+
+# Items filtered out of nutrition recommendations unless the user explicitly asks for junk food
+JUNK_FOOD_RE = re.compile(r'ketchup|mayonnaise|syrup|soda|candy|chips', re.IGNORECASE)
+
+# --- CHAT CARD TEMPLATES ---
+# Built once at import; only BMI_CARD_HTML needs str.format per request.
+# Shown for health intents until weight, height and goal are set
+PROFILE_INCOMPLETE_HTML = """
+                    <div class="bg-amber-50 dark:bg-amber-900/20 border border-amber-200 dark:border-amber-700 rounded-xl p-4">
+                        <div class="flex items-start gap-3">
+                            <div class="w-10 h-10 rounded-full bg-amber-100 dark:bg-amber-800 text-amber-600 dark:text-amber-300 flex items-center justify-center shrink-0">
+                                <i class="fas fa-user-edit"></i>
+                            </div>
+                            <div>
+                                <h4 class="font-bold text-amber-800 dark:text-amber-200 mb-1">Complete Your Profile First</h4>
+                                <p class="text-sm text-amber-700 dark:text-amber-300 mb-3">
+                                    To give you personalized workout and nutrition recommendations, I need to know a bit more about you.
+                                </p>
+                                <p class="text-sm text-amber-600 dark:text-amber-400">
+                                    Click the <b>"Start Setup"</b> button on the welcome screen, or go to <b>Settings → Edit Profile</b> to complete your profile.
+                                </p>
+                            </div>
+                        </div>
+                    </div>
+                """
+
+# BMI category (label, badge classes) for each band between the breakpoints
+BMI_BREAKPOINTS = (18.5, 25, 30)
+BMI_CATEGORIES = (
+    ("Underweight", "text-blue-600 bg-blue-100"),
+    ("Normal", "text-green-600 bg-green-100"),
+    ("Overweight", "text-orange-600 bg-orange-100"),
+    ("Obese", "text-red-600 bg-red-100")
+)
+
+# log_weight confirmation when the user also asked for their BMI
+BMI_CARD_HTML = """
+                            <div class="bg-emerald-50 dark:bg-emerald-900/20 p-5 rounded-xl border border-emerald-200 dark:border-emerald-800">
+                                <div class="flex items-center gap-3 mb-4">
+                                    <div class="w-12 h-12 rounded-full bg-emerald-500 text-white flex items-center justify-center">
+                                        <i class="fas fa-check text-xl"></i>
+                                    </div>
+                                    <div>
+                                        <h4 class="font-bold text-emerald-700 dark:text-emerald-300">Weight Updated!</h4>
+                                        <p class="text-sm text-emerald-600 dark:text-emerald-400">Your weight has been logged as <b>{weight} kg</b></p>
+                                    </div>
+                                </div>
+                                <div class="bg-white dark:bg-slate-800 rounded-xl p-4 border border-emerald-100 dark:border-slate-700">
+                                    <div class="text-xs font-bold text-slate-400 uppercase mb-1">Your Current BMI</div>
+                                    <div class="flex items-center gap-3">
+                                        <span class="text-3xl font-black text-slate-800 dark:text-white">{bmi:.1f}</span>
+                                        <span class="px-3 py-1 rounded-lg text-sm font-bold {color}">{category}</span>
+                                    </div>
+                                </div>
+                            </div>
+                            """
+
+# Prompts shown when a log intent arrives without usable values
+LOG_WEIGHT_PROMPT_HTML = """
+            <div class="bg-emerald-50 dark:bg-emerald-900/20 p-4 rounded-xl border border-emerald-200 dark:border-emerald-800">
+                <h4 class="font-bold text-emerald-700 dark:text-emerald-300 mb-2"><i class="fas fa-weight"></i> Log Your Weight</h4>
+                <p class="text-sm text-emerald-600 dark:text-emerald-400">Please tell me your current weight, like <b>"I weigh 75kg"</b> or <b>"My weight is 68.5 kg"</b></p>
+            </div>
+            """
 
+LOG_NUTRITION_PROMPT_HTML = """
+            <div class="bg-amber-50 dark:bg-amber-900/20 p-4 rounded-xl border border-amber-200 dark:border-amber-800">
+                <h4 class="font-bold text-amber-700 dark:text-amber-300 mb-2"><i class="fas fa-utensils"></i> Log Your Nutrition</h4>
+                <p class="text-sm text-amber-600 dark:text-amber-400 mb-2">Tell me what you ate! Examples:</p>
+                <ul class="text-sm text-amber-600 dark:text-amber-400 space-y-1">
+                    <li>• "I ate 500 calories"</li>
+                    <li>• "Log 40g protein and 300 calories"</li>
+                    <li>• "Had 50g carbs and 20g fat"</li>
+                </ul>
+            </div>
+            """
+
+# Shown when the workout log write fails (the user still gets a confirmation)
+LOG_WORKOUT_DONE_HTML = """
+            <div class="bg-blue-50 dark:bg-blue-900/20 p-4 rounded-xl border border-blue-200 dark:border-blue-800">
+                <h4 class="font-bold text-blue-700 dark:text-blue-300 mb-2"><i class="fas fa-dumbbell"></i> Workout Logged!</h4>
+                <p class="text-sm text-blue-600 dark:text-blue-400">Great job completing your workout! 💪</p>
+            </div>
+            """
+
+
+# --- WEEKLY WORKOUT TABLE ---
+# Built once at import; the workout_table handler only fills in the rows.
+# Messages mentioning a timetable/schedule get the weekly table whatever the NLU intent
+TIMETABLE_RE = re.compile(r'timetable|schedule', re.IGNORECASE)
+
+# (day, focus, target muscles) per weekday
+WEEKLY_SPLITS = {
+    'muscle': (
+        ('Monday', 'Push (Chest/Tri)', ('Chest', 'Triceps')),
+        ('Tuesday', 'Pull (Back/Bi)', ('Back', 'Biceps')),
+        ('Wednesday', 'Legs & Core', ('Legs', 'Core')),
+        ('Thursday', 'Push (Shoulders)', ('Shoulder', 'Chest')),
+        ('Friday', 'Pull & Arms', ('Back', 'Biceps', 'Triceps')),
+        ('Saturday', 'Rest', ()),
+        ('Sunday', 'Rest', ())
+    ),
+    'loss': (
+        ('Monday', 'Full Body HIIT', ('Full Body', 'Cardio')),
+        ('Tuesday', 'Upper Body', ('Chest', 'Back', 'Shoulder')),
+        ('Wednesday', 'Active Recovery', ()),
+        ('Thursday', 'Lower Body', ('Legs', 'Core')),
+        ('Friday', 'Full Body Circuit', ('Full Body',)),
+        ('Saturday', 'Cardio/HIIT', ('Cardio',)),
+        ('Sunday', 'Rest', ())
+    ),
+    'general': (
+        ('Monday', 'Upper Body', ('Chest', 'Back')),
+        ('Tuesday', 'Lower Body', ('Legs',)),
+        ('Wednesday', 'Rest', ()),
+        ('Thursday', 'Push Day', ('Chest', 'Shoulder', 'Triceps')),
+        ('Friday', 'Pull Day', ('Back', 'Biceps')),
+        ('Saturday', 'Full Body', ('Full Body',)),
+        ('Sunday', 'Rest', ())
+    )
+}
+
+TABLE_HTML = """
+                <div class="bg-white dark:bg-slate-800 rounded-2xl border border-slate-200 dark:border-slate-700 overflow-hidden shadow-lg">
+                    <div class="bg-gradient-to-r from-brand-500 to-brand-600 px-5 py-4">
+                        <h3 class="text-xl font-black text-white"><i class="fas fa-calendar-week mr-2"></i>Your Weekly Workout Schedule</h3>
+                        <p class="text-sm text-white/80 mt-1">Customized for <b>{goal}</b> • {level} Level</p>
+                    </div>
+                    <div class="overflow-x-auto">
+                        <table class="w-full">
+                            <thead class="bg-slate-50 dark:bg-slate-700/50">
+                                <tr>
+                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Day</th>
+                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Focus</th>
+                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Exercises</th>
+                                </tr>
+                            </thead>
+                            <tbody class="divide-y divide-slate-100 dark:divide-slate-700">
+{rows}
+                            </tbody>
+                        </table>
+                    </div>
+                    <div class="px-5 py-3 bg-slate-50 dark:bg-slate-700/30 text-xs text-slate-500 dark:text-slate-400">
+                        <i class="fas fa-lightbulb text-amber-500 mr-1"></i> Tip: Click on any exercise in the chat to see how to do it!
+                    </div>
+                </div>
+"""
+
+TABLE_ROW_HTML = """
+                    <tr class="{row_class}">
+                        <td class="px-4 py-3 font-bold text-slate-700 dark:text-slate-200">{day}</td>
+                        <td class="px-4 py-3"><span class="px-2 py-1 bg-brand-100 dark:bg-brand-900/30 text-brand-700 dark:text-brand-300 rounded-lg text-sm font-semibold">{focus}</span></td>
+                        <td class="px-4 py-3 text-sm text-slate-600 dark:text-slate-300">{exercises}</td>
+                    </tr>
+                """
+
+
+def render_split_rows(weekly_split, by_target):
+    """Yields one table row per day; exercises come from get_split_exercises()."""
+    for day, focus, targets in weekly_split:
+        if targets:
+            exercises = [name for target in targets[:2] for name in by_target[target]]
+
+            if not exercises:
+                exercises = [f"{t} workout" for t in targets[:3]]
+
+            exercises_str = ', '.join(exercises[:4])
+        else:
+            exercises_str = '<span class="text-slate-400">Active Recovery / Stretching</span>'
+
+        yield TABLE_ROW_HTML.format_map({
+            'row_class': 'bg-green-50 dark:bg-green-900/10' if focus == 'Rest' else '',
+            'day': day,
+            'focus': focus,
+            'exercises': exercises_str
+        })
+
+
+# The Fitness catalog is effectively static, so exercise picks per (level, targets) are kept for an hour
+split_exercise_cache = TTLCache(maxsize=64, ttl=3600)
+split_exercise_cache_lock = threading.Lock()
+
+
+def get_split_exercises(level, targets):
+    """Returns up to 2 exercise names per target muscle for a level, using one Firestore query."""
+    key = (level, targets)
+    with split_exercise_cache_lock:
+        cached = split_exercise_cache.get(key)
+    if cached is not None:
+        return cached
+
+    by_target = {target: [] for target in targets}
+    docs = db_client.collection('Fitness') \
+        .where(filter=FieldFilter('Level', '==', level)) \
+        .where(filter=FieldFilter('Primary_Muscle', 'in', list(targets))) \
+        .stream()
+    filled = 0
+    for doc in docs:
+        data = doc.to_dict()
+        names = by_target.get(data.get('Primary_Muscle'))
+        if names is None or len(names) >= 2:
+            continue
+        names.append(data.get('Exercise_Name', 'Exercise'))
+        if len(names) == 2:
+            filled += 1
+            if filled == len(by_target):
+                break
+
+    with split_exercise_cache_lock:
+        split_exercise_cache[key] = by_target
+    return by_target
+
+
+# --- STATIC PAYLOADS ---
+# Environment is fixed for the life of the process, so these are built once instead of per hit
+HEALTH_STATUS = {
+    "status": "healthy",
+    "service": "Atlas Backend API",
+    "version": "2.0"
+}
+
+FIREBASE_CLIENT_CONFIG = {
+    "apiKey": os.getenv('FIREBASE_API_KEY'),
+    "authDomain": os.getenv('FIREBASE_AUTH_DOMAIN'),
+    "projectId": os.getenv('FIREBASE_PROJECT_ID_CLIENT'),
+    "storageBucket": os.getenv('FIREBASE_STORAGE_BUCKET'),
+    "messagingSenderId": os.getenv('FIREBASE_MESSAGING_SENDER_ID'),
+    "appId": os.getenv('FIREBASE_APP_ID')
+}
 
 
 # --- ROUTES ---
 @app.route('/')
 def health_check():
     """Health check endpoint for Railway"""
-    return jsonify({
-        "status": "healthy",
-        "service": "Atlas Backend API",
-        "version": "2.0"
-    }), 200
+    return jsonify(HEALTH_STATUS), 200
 
 
 @app.route('/health')
@@ -115,21 +425,14 @@ def health():
 @app.route('/api/firebase-config')
 def firebase_config():
     """Serve Firebase client config from environment variables"""
-    return jsonify({
-        "apiKey": os.getenv('FIREBASE_API_KEY'),
-        "authDomain": os.getenv('FIREBASE_AUTH_DOMAIN'),
-        "projectId": os.getenv('FIREBASE_PROJECT_ID_CLIENT'),
-        "storageBucket": os.getenv('FIREBASE_STORAGE_BUCKET'),
-        "messagingSenderId": os.getenv('FIREBASE_MESSAGING_SENDER_ID'),
-        "appId": os.getenv('FIREBASE_APP_ID')
-    })
+    return jsonify(FIREBASE_CLIENT_CONFIG)
 
 
 # --- API ENDPOINTS ---
 @app.route('/load-profile', methods=['POST'])
 def load_profile():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         if not user_id:
             return jsonify({"success": False, "error": "No user ID provided"}), 400
@@ -141,20 +444,22 @@ def load_profile():
             return jsonify({"success": False, "error": "Profile not found"}), 404
 
     except Exception as e:
-        print(f"Error loading profile: {e}")
+        logger.error("Error loading profile: %s", e)
         return jsonify({"success": False, "error": "Server error"}), 500
 
 
 @app.route('/update-user-profile', methods=['POST'])
 def update_profile():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         updates = data.get('updates', {})
 
-        current_profile = user_manager.get_user(user_id) or {}
-        full_data = current_profile.copy()
-        full_data.update(updates)
+        current_profile = user_manager.get_user_fields(user_id, ('weight', 'height', 'age', 'gender', 'goal')) or {}
+
+        def pick(key, default):
+            """Submitted value if non-empty, else the stored one, else the default."""
+            return updates.get(key) or current_profile.get(key) or default
 
         clean_updates = {}
         allowed_fields = [
@@ -170,15 +475,16 @@ def update_profile():
         if 'weight' in updates and updates['weight']: clean_updates['weight'] = float(updates['weight'])
         if 'height' in updates and updates['height']: clean_updates['height'] = float(updates['height'])
 
-        w = float(full_data.get('weight', 0))
-        h = float(full_data.get('height', 0))
-        a = int(full_data.get('age', 0))
-        g = full_data.get('gender', 'Male')
-        goal = full_data.get('goal', 'General')
+        w = float(pick('weight', 0))
+        h = float(pick('height', 0))
+        a = int(pick('age', 0))
+        g = pick('gender', 'Male')
+        goal = pick('goal', 'General')
 
         if w > 0 and h > 0:
-            bmi = calculate_bmi(w, h)
-            if bmi: clean_updates['bmi'] = bmi
+            # Same formula as calculate_bmi; w and h are already validated floats here
+            h_m = h / 100
+            clean_updates['bmi'] = round(w / (h_m * h_m), 1)
 
         if w > 0 and h > 0 and a > 0:
             cals = calculate_target_calories(w, h, a, g, goal)
@@ -188,23 +494,23 @@ def update_profile():
         return jsonify({"success": True, "profile": clean_updates})
 
     except Exception as e:
-        print(f"Update Error: {e}")
+        logger.error("Update Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route('/generate-recipe', methods=['POST'])
 def generate_recipe_endpoint():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         food_name = data.get('food_name')
 
-        profile = user_manager.get_user(user_id) or {}
+        profile = user_manager.get_user_fields(user_id, ('goal',)) or {}
         recipe_html = nlu.generate_recipe(food_name, profile)
 
         return jsonify({"success": True, "recipe": recipe_html})
     except Exception as e:
-        print(f"Recipe Gen Error: {e}")
+        logger.error("Recipe Gen Error: %s", e)
         return jsonify({"success": False, "error": "Chef is busy!"}), 500
 
 
@@ -212,7 +518,7 @@ def generate_recipe_endpoint():
 def reset_preferences():
     """Clears user's likes and dislikes from session."""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         
         if not user_id:
@@ -224,14 +530,14 @@ def reset_preferences():
         
         return jsonify({"success": True, "message": "Preferences cleared"})
     except Exception as e:
-        print(f"Reset Preferences Error: {e}")
+        logger.error("Reset Preferences Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route('/feedback', methods=['POST'])
 def handle_feedback():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         item_data = data.get('item_data')
         rating = data.get('rating') # 'good' or 'bad'
@@ -253,7 +559,7 @@ def handle_feedback():
 
         return jsonify({"success": success, "message": msg})
     except Exception as e:
-        print(f"Feedback Error: {e}")
+        logger.error("Feedback Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
@@ -267,14 +573,14 @@ def get_favorites():
         favorites = user_manager.get_favorites(user_id)
         return jsonify({"success": True, "favorites": favorites})
     except Exception as e:
-        print(f"Get Favorites Error: {e}")
+        logger.error("Get Favorites Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route('/log-data', methods=['POST'])
 def log_data():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         log_type = data.get('type') # 'weight', 'nutrition'
         payload = data.get('data')
@@ -291,32 +597,140 @@ def log_data():
 
         return jsonify({"success": success})
     except Exception as e:
-        print(f"Log Data Error: {e}")
+        logger.error("Log Data Error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# --- CHAT INTENT HANDLERS ---
+@dataclass
+class ChatContext:
+    """Per-request state the response handlers need."""
+    user_id: str
+    message: str
+    intent: str
+    entities: dict
+    profile: dict
+    final_target: str
+    ignore_list: set
+    seen_titles: list
+    likes: list
+    dislikes: list
+    no_equipment: bool
+
+
+# Each handler returns (bot_response, response_type, rec_count) for the journey log.
+
+def _handle_text(ctx):
+    """A. TEXT GENERATION"""
+    return nlu.generate_response(ctx.profile, ctx.message, ctx.intent, ctx.entities), 'text_response', 0
+
+
+def _handle_fitness(ctx):
+    """B. FITNESS LOGIC"""
+    raw_recs = recommender.get_recommendations(
+        ctx.profile,
+        ctx.intent,
+        ctx.final_target,
+        ignore_list=ctx.ignore_list,
+        top_k=3,
+        likes=ctx.likes,
+        dislikes=ctx.dislikes,
+        no_equipment=ctx.no_equipment
+    )
+    recs, warnings = SafetyValidator().filter_exercises_for_injuries(raw_recs,
+                                                                     ctx.profile.get('medical_conditions', ''))
+
+    if recs:
+        titles = [r.get('Title') for r in recs]
+        ctx.seen_titles.extend(titles)
+        memory.log_interactions(ctx.user_id, titles, 'exercises')
+
+        return format_exercise_card(recs, ctx.intent, ctx.final_target), 'fitness_recommendation', len(recs)
+
+    return nlu.generate_response(ctx.profile, ctx.message, 'general_chat'), 'fitness_fallback', 0
+
+
+def _handle_nutrition(ctx):
+    """C. NUTRITION LOGIC"""
+    extra_entities = {
+        'preference': ctx.entities.get('preference'),
+        'category': ctx.entities.get('category')
+    }
+
+    recs = recommender.get_recommendations(
+        ctx.profile,
+        'nutrition_request',
+        ctx.final_target,
+        ignore_list=ctx.ignore_list,
+        extra_entities=extra_entities,
+        top_k=3,
+        likes=ctx.likes,
+        dislikes=ctx.dislikes
+    )
+
+    filtered_recs = []
+    allow_junk = 'junk' in ctx.final_target.lower()
+    for item in recs:
+        if not allow_junk and JUNK_FOOD_RE.search(item.get('Name', '')):
+            continue
+        filtered_recs.append(item)
+
+    if filtered_recs:
+        names = [r.get('Name') for r in filtered_recs]
+        ctx.seen_titles.extend(names)
+        memory.log_interactions(ctx.user_id, names, 'foods')
+
+        return format_nutrition_card(filtered_recs, ctx.intent, ctx.final_target), 'nutrition_recommendation', len(filtered_recs)
+
+    return nlu.generate_response(ctx.profile, ctx.message, 'general_chat'), 'nutrition_fallback', 0
+
+
+def _handle_fallback(ctx):
+    """D. CATCH-ALL"""
+    logger.warning("Unhandled intent '%s'. Falling back to NLU.", ctx.intent)
+    return nlu.generate_response(ctx.profile, ctx.message, 'general_chat'), 'fallback_response', 0
+
+
+INTENT_HANDLERS = {
+    'explain_exercise': _handle_text,
+    'general_chat': _handle_text,
+    'nutrition_options': _handle_text,
+    'out_of_scope': _handle_text,
+    'add_preference': _handle_text,
+    'add_dislike': _handle_text,
+    'clear_preferences': _handle_text,
+    'health_inquiry': _handle_text,
+    'fitness_request': _handle_fitness,
+    'fitness_variation': _handle_fitness,
+    'nutrition_request': _handle_nutrition,
+    'nutrition_variation': _handle_nutrition
+}
+
+
 @app.route('/get-recommendation', methods=['POST'])
 @limiter.limit(SecurityConfig.RATE_LIMIT_CHAT)
 def chat_endpoint():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         message = data.get('message')
-        session_data = data.get('session', {})
+        session_data = data.get('session') or {}
 
-        history = session_data.get('history', [])
-        seen_titles = session_data.get('seen_titles', [])
+        history = deque(session_data.get('history') or (), maxlen=MAX_HISTORY)
+        seen_titles = session_data.get('seen_titles') or []
         last_target = session_data.get('last_target', None)
 
         # --- PREFERENCE MANAGEMENT (Session) ---
-        likes = session_data.get('likes', [])
-        dislikes = session_data.get('dislikes', [])
+        # dicts used as ordered sets: O(1) membership, duplicates from older sessions collapse
+        likes = dict.fromkeys(session_data.get('likes') or ())
+        dislikes = dict.fromkeys(session_data.get('dislikes') or ())
 
-        # 1. FETCH PROFILE
-        profile = user_manager.get_user(user_id) or {}
+        # 1. FETCH PROFILE (runs in the background while the NLU call is in flight)
+        profile_future = executor.submit(user_manager.get_user_fields, user_id, CHAT_PROFILE_FIELDS)
 
         # 2. ANALYZE INTENT
         analysis = nlu.analyze_message(message, history)
+        profile = profile_future.result() or {}
         intent = analysis.get('intent', 'general_chat')
         entities = analysis.get('entities', {})
         new_target = entities.get('target', None)
@@ -332,82 +746,45 @@ def chat_endpoint():
         # Merge singular and list preferences
         if pref_item: pref_list.append(pref_item)
 
-        # ALWAYS process preferences from entities (for compound messages like "I like X, give me workout")
-        for item in pref_list:
-            clean_item = item.lower().strip()
-            if clean_item and clean_item not in likes:
-                likes.append(clean_item)
-            if clean_item in dislikes:
-                dislikes.remove(clean_item)
-
-        # ALWAYS process dislikes from entities (for compound messages like "I hate X, suggest workout")
-        for item in dislike_list:
-            clean_item = item.lower().strip()
-            if clean_item and clean_item not in dislikes:
-                dislikes.append(clean_item)
-            if clean_item in likes:
-                likes.remove(clean_item)
+        # ALWAYS process preferences and dislikes from entities (for compound messages like
+        # "I like X, give me workout"). Items are normalized once; a dislike wins over a like.
+        liked = dict.fromkeys(clean for clean in (item.lower().strip() for item in pref_list) if clean)
+        disliked = dict.fromkeys(clean for clean in (item.lower().strip() for item in dislike_list) if clean)
+
+        likes = [item for item in {**likes, **liked} if item not in disliked]
+        dislikes = list({**{item: None for item in dislikes if item not in liked}, **disliked})
 
         # Clear Preferences (only when explicitly requested)
         if intent == 'clear_preferences':
             likes = []
             dislikes = []
 
+        # Written back now so the early-return handlers below also persist the updated preferences
+        session_data['likes'] = likes
+        session_data['dislikes'] = dislikes
+
         # --- HANDLE NO EQUIPMENT FLAG ---
         no_equipment = session_data.get('no_equipment', False)
         if entities.get('no_equipment'):
             no_equipment = True
             session_data['no_equipment'] = True
 
-        # Debug log to verify preferences are being captured
-        print(f"[App] After processing - Likes: {likes}, Dislikes: {dislikes}, No Equipment: {no_equipment}")
-
-        # Define health-related intents that require profile access
-        health_intents = [
-            'fitness_request', 'fitness_variation',
-            'nutrition_request', 'nutrition_variation',
-            'explain_exercise', 'nutrition_recipe'
-        ]
-        
-        # Progress tracking intents (don't require full profile)
-        progress_intents = ['log_weight', 'log_nutrition', 'log_workout', 'view_progress']
+        # Debug log to verify preferences are being captured (lazy %-args: skipped unless LOG_LEVEL=DEBUG)
+        logger.debug("After processing - Likes: %s, Dislikes: %s, No Equipment: %s", likes, dislikes, no_equipment)
 
         # 3. CHECK PROFILE COMPLETENESS FOR HEALTH INTENTS
-        if intent in health_intents:
+        if intent in HEALTH_INTENTS:
             # Check if profile has required fields for personalized recommendations
-            has_weight = profile.get('weight') is not None and profile.get('weight') != ''
-            has_height = profile.get('height') is not None and profile.get('height') != ''
-            has_goal = profile.get('goal') is not None and profile.get('goal') != ''
-            
-            if not (has_weight and has_height and has_goal):
-                incomplete_msg = """
-                    <div class="bg-amber-50 dark:bg-amber-900/20 border border-amber-200 dark:border-amber-700 rounded-xl p-4">
-                        <div class="flex items-start gap-3">
-                            <div class="w-10 h-10 rounded-full bg-amber-100 dark:bg-amber-800 text-amber-600 dark:text-amber-300 flex items-center justify-center shrink-0">
-                                <i class="fas fa-user-edit"></i>
-                            </div>
-                            <div>
-                                <h4 class="font-bold text-amber-800 dark:text-amber-200 mb-1">Complete Your Profile First</h4>
-                                <p class="text-sm text-amber-700 dark:text-amber-300 mb-3">
-                                    To give you personalized workout and nutrition recommendations, I need to know a bit more about you.
-                                </p>
-                                <p class="text-sm text-amber-600 dark:text-amber-400">
-                                    Click the <b>"Start Setup"</b> button on the welcome screen, or go to <b>Settings → Edit Profile</b> to complete your profile.
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                """
-                return jsonify({"reply": incomplete_msg, "session": session_data, "intent": "profile_incomplete"})
+            if not (profile.get('weight') and profile.get('height') and profile.get('goal')):
+                return jsonify({"reply": PROFILE_INCOMPLETE_HTML, "session": session_data, "intent": "profile_incomplete"})
 
         # 4. CONDITIONAL SAFETY CHECK
-        if intent in health_intents:
+        if intent in HEALTH_INTENTS:
             is_safe, safety_msg = SafetyValidator.validate_request(profile)
             if not is_safe:
-                if db_client:
-                    db_client.collection('users').document(user_id).collection('journey_logs').add({
-                        'timestamp': datetime.now(), 'intent': 'safety_block', 'user_message': message
-                    })
+                journey_logger.log(user_id, {
+                    'timestamp': firestore.SERVER_TIMESTAMP, 'intent': 'safety_block', 'user_message': message
+                })
                 return jsonify({"reply": safety_msg, "session": session_data, "intent": "safety_block"})
 
         # ============================================
@@ -429,40 +806,11 @@ def chat_endpoint():
                         if ask_bmi and profile.get('height'):
                             height_m = float(profile.get('height')) / 100
                             new_bmi = weight / (height_m * height_m)
-                            bmi_category = ""
-                            if new_bmi < 18.5:
-                                bmi_category = "Underweight"
-                                cat_color = "text-blue-600 bg-blue-100"
-                            elif new_bmi < 25:
-                                bmi_category = "Normal"
-                                cat_color = "text-green-600 bg-green-100"
-                            elif new_bmi < 30:
-                                bmi_category = "Overweight"
-                                cat_color = "text-orange-600 bg-orange-100"
-                            else:
-                                bmi_category = "Obese"
-                                cat_color = "text-red-600 bg-red-100"
+                            bmi_category, cat_color = BMI_CATEGORIES[bisect_right(BMI_BREAKPOINTS, new_bmi)]
                             
-                            response = f"""
-                            <div class="bg-emerald-50 dark:bg-emerald-900/20 p-5 rounded-xl border border-emerald-200 dark:border-emerald-800">
-                                <div class="flex items-center gap-3 mb-4">
-                                    <div class="w-12 h-12 rounded-full bg-emerald-500 text-white flex items-center justify-center">
-                                        <i class="fas fa-check text-xl"></i>
-                                    </div>
-                                    <div>
-                                        <h4 class="font-bold text-emerald-700 dark:text-emerald-300">Weight Updated!</h4>
-                                        <p class="text-sm text-emerald-600 dark:text-emerald-400">Your weight has been logged as <b>{weight} kg</b></p>
-                                    </div>
-                                </div>
-                                <div class="bg-white dark:bg-slate-800 rounded-xl p-4 border border-emerald-100 dark:border-slate-700">
-                                    <div class="text-xs font-bold text-slate-400 uppercase mb-1">Your Current BMI</div>
-                                    <div class="flex items-center gap-3">
-                                        <span class="text-3xl font-black text-slate-800 dark:text-white">{new_bmi:.1f}</span>
-                                        <span class="px-3 py-1 rounded-lg text-sm font-bold {cat_color}">{bmi_category}</span>
-                                    </div>
-                                </div>
-                            </div>
-                            """
+                            response = BMI_CARD_HTML.format(
+                                weight=weight, bmi=new_bmi, category=bmi_category, color=cat_color
+                            )
                         else:
                             response = format_log_confirmation('weight', result)
                         
@@ -471,12 +819,7 @@ def chat_endpoint():
                     pass
             
             # If weight not extracted, ask for it
-            response = """
-            <div class="bg-emerald-50 dark:bg-emerald-900/20 p-4 rounded-xl border border-emerald-200 dark:border-emerald-800">
-                <h4 class="font-bold text-emerald-700 dark:text-emerald-300 mb-2"><i class="fas fa-weight"></i> Log Your Weight</h4>
-                <p class="text-sm text-emerald-600 dark:text-emerald-400">Please tell me your current weight, like <b>"I weigh 75kg"</b> or <b>"My weight is 68.5 kg"</b></p>
-            </div>
-            """
+            response = LOG_WEIGHT_PROMPT_HTML
             return jsonify({"reply": response, "session": session_data, "intent": "log_weight"})
 
 
@@ -510,17 +853,7 @@ def chat_endpoint():
                     return jsonify({"reply": response, "session": session_data, "intent": "log_nutrition"})
             
             # If nothing extracted, ask for details
-            response = """
-            <div class="bg-amber-50 dark:bg-amber-900/20 p-4 rounded-xl border border-amber-200 dark:border-amber-800">
-                <h4 class="font-bold text-amber-700 dark:text-amber-300 mb-2"><i class="fas fa-utensils"></i> Log Your Nutrition</h4>
-                <p class="text-sm text-amber-600 dark:text-amber-400 mb-2">Tell me what you ate! Examples:</p>
-                <ul class="text-sm text-amber-600 dark:text-amber-400 space-y-1">
-                    <li>• "I ate 500 calories"</li>
-                    <li>• "Log 40g protein and 300 calories"</li>
-                    <li>• "Had 50g carbs and 20g fat"</li>
-                </ul>
-            </div>
-            """
+            response = LOG_NUTRITION_PROMPT_HTML
             return jsonify({"reply": response, "session": session_data, "intent": "log_nutrition"})
 
         # 5c. LOG WORKOUT HANDLER
@@ -535,12 +868,7 @@ def chat_endpoint():
                 return jsonify({"reply": response, "session": session_data, "intent": "log_workout"})
             
             # Fallback
-            response = """
-            <div class="bg-blue-50 dark:bg-blue-900/20 p-4 rounded-xl border border-blue-200 dark:border-blue-800">
-                <h4 class="font-bold text-blue-700 dark:text-blue-300 mb-2"><i class="fas fa-dumbbell"></i> Workout Logged!</h4>
-                <p class="text-sm text-blue-600 dark:text-blue-400">Great job completing your workout! 💪</p>
-            </div>
-            """
+            response = LOG_WORKOUT_DONE_HTML
             return jsonify({"reply": response, "session": session_data, "intent": "log_workout"})
 
         # 5d. VIEW PROGRESS HANDLER
@@ -560,13 +888,12 @@ def chat_endpoint():
                 target_calories = 2000
                 if profile.get('weight') and profile.get('height') and profile.get('age'):
                     target_calories = calculate_target_calories(
-                        profile.get('weight'),
-                        profile.get('height'),
-                        profile.get('age'),
+                        float(profile.get('weight')),
+                        float(profile.get('height')),
+                        float(profile.get('age')),
                         profile.get('gender', 'Male'),
-                        profile.get('activity_level', 'Moderate'),
                         profile.get('goal', 'Maintain')
-                    )
+                    ) or target_calories
                 response = format_nutrition_report(today_data, target_calories)
                 return jsonify({"reply": response, "session": session_data, "intent": "view_progress"})
             
@@ -587,7 +914,7 @@ def chat_endpoint():
 
 
         # 5. WORKOUT TABLE HANDLER - Weekly workout schedule with real data
-        if intent == 'workout_table' or 'timetable' in message.lower() or 'schedule' in message.lower():
+        if intent == 'workout_table' or TIMETABLE_RE.search(message):
             # Extract workout/rest days from entities or default to 5/2
             workout_days = entities.get('workout_days', 5)
             rest_days = entities.get('rest_days', 2)
@@ -596,93 +923,22 @@ def chat_endpoint():
             goal = profile.get('goal', 'General Fitness')
             level = profile.get('fitness_level', 'Beginner')
             
-            # Create weekly split
+            # Pick the weekly split for this goal
             if 'Muscle' in goal or 'Strength' in goal:
-                weekly_split = [
-                    {'day': 'Monday', 'focus': 'Push (Chest/Tri)', 'targets': ['Chest', 'Triceps']},
-                    {'day': 'Tuesday', 'focus': 'Pull (Back/Bi)', 'targets': ['Back', 'Biceps']},
-                    {'day': 'Wednesday', 'focus': 'Legs & Core', 'targets': ['Legs', 'Core']},
-                    {'day': 'Thursday', 'focus': 'Push (Shoulders)', 'targets': ['Shoulder', 'Chest']},
-                    {'day': 'Friday', 'focus': 'Pull & Arms', 'targets': ['Back', 'Biceps', 'Triceps']},
-                    {'day': 'Saturday', 'focus': 'Rest', 'targets': []},
-                    {'day': 'Sunday', 'focus': 'Rest', 'targets': []}
-                ]
+                weekly_split = WEEKLY_SPLITS['muscle']
             elif 'Loss' in goal:
-                weekly_split = [
-                    {'day': 'Monday', 'focus': 'Full Body HIIT', 'targets': ['Full Body', 'Cardio']},
-                    {'day': 'Tuesday', 'focus': 'Upper Body', 'targets': ['Chest', 'Back', 'Shoulder']},
-                    {'day': 'Wednesday', 'focus': 'Active Recovery', 'targets': []},
-                    {'day': 'Thursday', 'focus': 'Lower Body', 'targets': ['Legs', 'Core']},
-                    {'day': 'Friday', 'focus': 'Full Body Circuit', 'targets': ['Full Body']},
-                    {'day': 'Saturday', 'focus': 'Cardio/HIIT', 'targets': ['Cardio']},
-                    {'day': 'Sunday', 'focus': 'Rest', 'targets': []}
-                ]
+                weekly_split = WEEKLY_SPLITS['loss']
             else:
-                weekly_split = [
-                    {'day': 'Monday', 'focus': 'Upper Body', 'targets': ['Chest', 'Back']},
-                    {'day': 'Tuesday', 'focus': 'Lower Body', 'targets': ['Legs']},
-                    {'day': 'Wednesday', 'focus': 'Rest', 'targets': []},
-                    {'day': 'Thursday', 'focus': 'Push Day', 'targets': ['Chest', 'Shoulder', 'Triceps']},
-                    {'day': 'Friday', 'focus': 'Pull Day', 'targets': ['Back', 'Biceps']},
-                    {'day': 'Saturday', 'focus': 'Full Body', 'targets': ['Full Body']},
-                    {'day': 'Sunday', 'focus': 'Rest', 'targets': []}
-                ]
-            
-            # Fetch real exercises from Firestore for each day
-            table_rows = []
-            for day_plan in weekly_split:
-                if day_plan['targets']:
-                    exercises = []
-                    for target in day_plan['targets'][:2]:  # Max 2 targets per day
-                        try:
-                            docs = db_client.collection('Fitness').where('Primary_Muscle', '==', target).where('Level', '==', level).limit(2).stream()
-                            for doc in docs:
-                                data = doc.to_dict()
-                                exercises.append(data.get('Exercise_Name', 'Exercise'))
-                        except:
-                            exercises.append(f"{target} Exercise")
-                    
-                    if not exercises:
-                        exercises = [f"{t} workout" for t in day_plan['targets'][:3]]
-                    
-                    exercises_str = ', '.join(exercises[:4])
-                else:
-                    exercises_str = '<span class="text-slate-400">Active Recovery / Stretching</span>'
-                
-                row_class = 'bg-green-50 dark:bg-green-900/10' if day_plan['focus'] == 'Rest' else ''
-                table_rows.append(f"""
-                    <tr class="{row_class}">
-                        <td class="px-4 py-3 font-bold text-slate-700 dark:text-slate-200">{day_plan['day']}</td>
-                        <td class="px-4 py-3"><span class="px-2 py-1 bg-brand-100 dark:bg-brand-900/30 text-brand-700 dark:text-brand-300 rounded-lg text-sm font-semibold">{day_plan['focus']}</span></td>
-                        <td class="px-4 py-3 text-sm text-slate-600 dark:text-slate-300">{exercises_str}</td>
-                    </tr>
-                """)
-            
-            table_html = f"""
-                <div class="bg-white dark:bg-slate-800 rounded-2xl border border-slate-200 dark:border-slate-700 overflow-hidden shadow-lg">
-                    <div class="bg-gradient-to-r from-brand-500 to-brand-600 px-5 py-4">
-                        <h3 class="text-xl font-black text-white"><i class="fas fa-calendar-week mr-2"></i>Your Weekly Workout Schedule</h3>
-                        <p class="text-sm text-white/80 mt-1">Customized for <b>{goal}</b> • {level} Level</p>
-                    </div>
-                    <div class="overflow-x-auto">
-                        <table class="w-full">
-                            <thead class="bg-slate-50 dark:bg-slate-700/50">
-                                <tr>
-                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Day</th>
-                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Focus</th>
-                                    <th class="px-4 py-3 text-left text-xs font-bold text-slate-500 dark:text-slate-400 uppercase tracking-wider">Exercises</th>
-                                </tr>
-                            </thead>
-                            <tbody class="divide-y divide-slate-100 dark:divide-slate-700">
-                                {''.join(table_rows)}
-                            </tbody>
-                        </table>
-                    </div>
-                    <div class="px-5 py-3 bg-slate-50 dark:bg-slate-700/30 text-xs text-slate-500 dark:text-slate-400">
-                        <i class="fas fa-lightbulb text-amber-500 mr-1"></i> Tip: Click on any exercise in the chat to see how to do it!
-                    </div>
-                </div>
-            """
+                weekly_split = WEEKLY_SPLITS['general']
+
+            # Fetch real exercises for every target of the week with a single Firestore query
+            all_targets = tuple(dict.fromkeys(t for _, _, targets in weekly_split for t in targets[:2]))  # Max 2 targets per day
+            try:
+                by_target = get_split_exercises(level, all_targets)
+            except:
+                by_target = {target: [f"{target} Exercise"] for target in all_targets}
+
+            table_html = TABLE_HTML.format(goal=goal, level=level, rows=''.join(render_split_rows(weekly_split, by_target)))
             return jsonify({"reply": table_html, "session": session_data, "intent": "workout_table"})
 
         # Helper for Logging
@@ -692,7 +948,7 @@ def chat_endpoint():
         def log_journey_entry(response_type, rec_count=0):
             try:
                 log_data = {
-                    'timestamp': datetime.now(),
+                    'timestamp': firestore.SERVER_TIMESTAMP,
                     'intent': intent,
                     'user_message': message[:100],
                     'response_type': response_type,
@@ -700,118 +956,53 @@ def chat_endpoint():
                     'rec_count': rec_count,
                     'bot_response_preview': str(bot_response)[:50] + "..."
                 }
-                if db_client:
-                    db_client.collection('users').document(user_id).collection('journey_logs').add(log_data)
+                journey_logger.log(user_id, log_data)
             except Exception as e:
-                print(f"Journey log error: {e}")
+                logger.error("Journey log error: %s", e)
 
         # 5. CONTEXT & MEMORY SETUP
-        if intent in ['fitness_variation', 'nutrition_variation']:
+        if intent in VARIATION_INTENTS:
             final_target = last_target if last_target else "General"
-        elif intent in ['fitness_request', 'nutrition_request']:
+        elif intent in NEW_REQUEST_INTENTS:
             final_target = new_target or "General"
             seen_titles = []
             last_target = final_target
 
-        memory = SimpleMemory(db_client)
         recent_items = []
-        if 'fitness' in intent:
+        if intent in FITNESS_INTENTS:
             recent_items = memory.get_recent_items(user_id, 'exercises')
-        elif 'nutrition' in intent:
+        elif intent in NUTRITION_INTENTS:
             recent_items = memory.get_recent_items(user_id, 'foods')
-        ignore_list = list(set(seen_titles + recent_items))
-
-        # 6. GENERATE RESPONSE BASED ON INTENT
-
-        # A. TEXT GENERATION
-        text_intents = ['explain_exercise', 'general_chat', 'nutrition_options', 'out_of_scope', 'add_preference',
-                        'add_dislike', 'clear_preferences', 'health_inquiry']
-
-        if intent in text_intents:
-            bot_response = nlu.generate_response(profile, message, intent)
-            log_journey_entry('text_response', 0)
-
-        # B. FITNESS LOGIC
-        elif intent in ['fitness_request', 'fitness_variation']:
-            raw_recs = recommender.get_recommendations(
-                profile,
-                intent,
-                final_target,
-                ignore_list=ignore_list,
-                top_k=3,
-                likes=likes,
-                dislikes=dislikes,
-                no_equipment=no_equipment
-            )
-            recs, warnings = SafetyValidator().filter_exercises_for_injuries(raw_recs,
-                                                                             profile.get('medical_conditions', ''))
-
-            if recs:
-                for r in recs:
-                    seen_titles.append(r.get('Title'))
-                    memory.log_interaction(user_id, r.get('Title'), 'exercises')
-
-                bot_response = format_exercise_card(recs, intent, final_target)
-                log_journey_entry('fitness_recommendation', len(recs))
-            else:
-                bot_response = nlu.generate_response(profile, message, 'general_chat')
-                log_journey_entry('fitness_fallback', 0)
-
-        # C. NUTRITION LOGIC
-        elif intent in ['nutrition_request', 'nutrition_variation']:
-            extra_entities = {
-                'preference': entities.get('preference'),
-                'category': entities.get('category')
-            }
-
-            recs = recommender.get_recommendations(
-                profile,
-                'nutrition_request',
-                final_target,
-                ignore_list=ignore_list,
-                extra_entities=extra_entities,
-                top_k=3,
-                likes=likes,
-                dislikes=dislikes
-            )
-
-            filtered_recs = []
-            junk_keywords = ['ketchup', 'mayonnaise', 'syrup', 'soda', 'candy', 'chips']
-            for item in recs:
-                name = item.get('Name', '').lower()
-                if any(junk in name for junk in junk_keywords) and 'junk' not in final_target.lower():
-                    continue
-                filtered_recs.append(item)
-
-            if filtered_recs:
-                for r in filtered_recs:
-                    seen_titles.append(r.get('Name'))
-                    memory.log_interaction(user_id, r.get('Name'), 'foods')
-
-                bot_response = format_nutrition_card(filtered_recs, intent, final_target)
-                log_journey_entry('nutrition_recommendation', len(filtered_recs))
-            else:
-                bot_response = nlu.generate_response(profile, message, 'general_chat')
-                log_journey_entry('nutrition_fallback', 0)
-
-        # D. CATCH-ALL BLOCK
-        else:
-            print(f"Warning: Unhandled intent '{intent}'. Falling back to NLU.")
-            bot_response = nlu.generate_response(profile, message, 'general_chat')
-            log_journey_entry('fallback_response', 0)
+        ignore_list = set(seen_titles).union(recent_items)
+
+        # 6. GENERATE RESPONSE BASED ON INTENT (see INTENT_HANDLERS; unknown intents fall back to general chat)
+        ctx = ChatContext(
+            user_id=user_id,
+            message=message,
+            intent=intent,
+            entities=entities,
+            profile=profile,
+            final_target=final_target,
+            ignore_list=ignore_list,
+            seen_titles=seen_titles,
+            likes=likes,
+            dislikes=dislikes,
+            no_equipment=no_equipment
+        )
+        handler = INTENT_HANDLERS.get(intent, _handle_fallback)
+        bot_response, response_type, rec_count = handler(ctx)
+        log_journey_entry(response_type, rec_count)
 
         # 7. SESSION UPDATE
         history.append({"role": "user", "content": message})
-        session_data['history'] = history[-6:]
-        session_data['seen_titles'] = seen_titles
+        session_data['history'] = list(history)
+        session_data['seen_titles'] = seen_titles[-MAX_SEEN_TITLES:]
         session_data['last_target'] = last_target
-        session_data['likes'] = likes
-        session_data['dislikes'] = dislikes
 
         return jsonify({"reply": bot_response, "session": session_data, "intent": intent})
 
     except Exception as e:
-        print(f"Endpoint Error: {e}")
+        logger.error("Endpoint Error: %s", e)
         return jsonify({"reply": "I'm having a brief brain freeze. Try again?", "session": {}}), 200
 
 
@@ -828,62 +1019,66 @@ def list_conversations():
         if not user_id or not db_client:
             return jsonify({"success": False, "conversations": []})
 
-        convos_ref = db_client.collection('users').document(user_id) \
-            .collection('conversations') \
-            .order_by('updated_at', direction=firestore.Query.DESCENDING) \
-            .limit(20)
-
-        def convert_timestamp(ts):
-            """Convert Firestore Timestamp or datetime to ISO string."""
-            if ts is None:
-                return None
-            # Firestore Timestamp object
-            if hasattr(ts, 'seconds'):
-                return datetime.fromtimestamp(ts.seconds + ts.nanoseconds / 1e9).isoformat()
-            # Python datetime object
-            if hasattr(ts, 'isoformat'):
-                return ts.isoformat()
-            # Already a string
-            if isinstance(ts, str):
-                return ts
-            return None
-
-        conversations = []
-        for doc in convos_ref.stream():
-            data = doc.to_dict()
-            conversations.append({
-                'id': doc.id,
-                'title': data.get('title', 'New Chat'),
-                'updated_at': convert_timestamp(data.get('updated_at')),
-                'message_count': len(data.get('messages', []))
-            })
-
-        return jsonify({"success": True, "conversations": conversations})
+        conversations = _fetch_conversation_list(user_id)
+
+        # ETag lets a polling client get a 304 instead of the full listing
+        response = jsonify({"success": True, "conversations": conversations})
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
-        print(f"List conversations error: {e}")
+        logger.error("List conversations error: %s", e)
         return jsonify({"success": False, "conversations": []})
 
 
+def convert_timestamp(ts):
+    """Datetimes and strings serialize as-is (orjson); raw protobuf Timestamps become datetimes."""
+    if isinstance(ts, datetime):  # Firestore's DatetimeWithNanoseconds, the usual case
+        return ts
+    if isinstance(ts, str):
+        return ts
+    if isinstance(ts, Timestamp):
+        return datetime.fromtimestamp(ts.seconds + ts.nanos / 1e9, timezone.utc)
+    return None
+
+
+def _fetch_conversation_list(user_id):
+    """Queries the 20 most recently updated conversations for the sidebar."""
+    conversations = []
+    for doc in recent_conversations_query(user_id).stream():
+        data = doc.to_dict()
+        conversation = {
+            'id': doc.id,
+            'title': data.get('title', 'New Chat'),
+            'updated_at': convert_timestamp(data.get('updated_at'))
+        }
+        # Conversations created before the counter only get one once opened (see get_conversation)
+        if 'message_count' in data:
+            conversation['message_count'] = data['message_count']
+        conversations.append(conversation)
+
+    return conversations
+
+
 @app.route('/conversations', methods=['POST'])
 def create_conversation():
     """Create a new conversation."""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         if not user_id or not db_client:
             return jsonify({"success": False})
 
-        # Create new conversation document
+        # Create new conversation document (stored times come from the server; `now` is only echoed back)
         now = datetime.now(timezone.utc)
-        conv_ref = db_client.collection('users').document(user_id) \
-            .collection('conversations').document()
+        conv_ref = user_conversations(user_id).document()
 
         conv_data = {
             'id': conv_ref.id,
             'title': 'New Chat',
-            'created_at': now,
-            'updated_at': now,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'updated_at': firestore.SERVER_TIMESTAMP,
             'messages': [],
+            'message_count': 0,
             'session': {}
         }
         conv_ref.set(conv_data)
@@ -898,7 +1093,7 @@ def create_conversation():
             }
         })
     except Exception as e:
-        print(f"Create conversation error: {e}")
+        logger.error("Create conversation error: %s", e)
         return jsonify({"success": False})
 
 
@@ -910,25 +1105,32 @@ def get_conversation(conversation_id):
         if not user_id or not db_client:
             return jsonify({"success": False})
 
-        conv_ref = db_client.collection('users').document(user_id) \
-            .collection('conversations').document(conversation_id)
+        # Not cached: with several gunicorn workers a per-process copy would miss
+        # messages another worker just saved
+        conv_ref = user_conversations(user_id).document(conversation_id)
         doc = conv_ref.get()
 
         if not doc.exists:
             return jsonify({"success": False, "error": "Conversation not found"})
 
         data = doc.to_dict()
-        return jsonify({
-            "success": True,
-            "conversation": {
-                'id': doc.id,
-                'title': data.get('title', 'New Chat'),
-                'messages': data.get('messages', []),
-                'session': data.get('session', {})
-            }
-        })
+        messages = data.get('messages', [])
+
+        # Backfill the listing counter on conversations saved before it existed
+        # (an Increment on a missing field starts from zero)
+        if data.get('message_count') != len(messages):
+            conv_ref.update({'message_count': len(messages)})
+
+        conversation = {
+            'id': doc.id,
+            'title': data.get('title', 'New Chat'),
+            'messages': messages,
+            'session': data.get('session', {})
+        }
+
+        return jsonify({"success": True, "conversation": conversation})
     except Exception as e:
-        print(f"Get conversation error: {e}")
+        logger.error("Get conversation error: %s", e)
         return jsonify({"success": False})
 
 
@@ -936,17 +1138,18 @@ def get_conversation(conversation_id):
 def delete_conversation(conversation_id):
     """Delete a conversation."""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         if not user_id or not db_client:
             return jsonify({"success": False})
 
-        db_client.collection('users').document(user_id) \
-            .collection('conversations').document(conversation_id).delete()
+        user_conversations(user_id).document(conversation_id).delete()
+        with conversation_title_lock:
+            conversation_title_cache.pop((user_id, conversation_id), None)
 
         return jsonify({"success": True})
     except Exception as e:
-        print(f"Delete conversation error: {e}")
+        logger.error("Delete conversation error: %s", e)
         return jsonify({"success": False})
 
 
@@ -954,7 +1157,7 @@ def delete_conversation(conversation_id):
 def save_message(conversation_id):
     """Save a message to a conversation."""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_id = data.get('user_id')
         role = data.get('role')  # 'user' or 'ai'
         content = data.get('content')
@@ -962,15 +1165,7 @@ def save_message(conversation_id):
         if not user_id or not db_client or not role or not content:
             return jsonify({"success": False})
 
-        conv_ref = db_client.collection('users').document(user_id) \
-            .collection('conversations').document(conversation_id)
-
-        doc = conv_ref.get()
-        if not doc.exists:
-            return jsonify({"success": False, "error": "Conversation not found"})
-
-        conv_data = doc.to_dict()
-        messages = conv_data.get('messages', [])
+        conv_ref = user_conversations(user_id).document(conversation_id)
 
         # Add new message
         new_message = {
@@ -978,29 +1173,49 @@ def save_message(conversation_id):
             'content': content,
             'timestamp': datetime.now(timezone.utc).isoformat()
         }
-        messages.append(new_message)
 
-        # Auto-generate title from first user message
-        title = conv_data.get('title', 'New Chat')
-        if title == 'New Chat' and role == 'user':
-            # Use first 40 chars of first message as title
-            title = content[:40] + ('...' if len(content) > 40 else '')
-
-        # Update conversation
-        conv_ref.update({
-            'messages': messages,
-            'updated_at': datetime.now(timezone.utc),
-            'title': title
-        })
+        # Append atomically instead of reading and rewriting the whole messages array
+        updates = {
+            'messages': firestore.ArrayUnion([new_message]),
+            'message_count': firestore.Increment(1),
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }
 
-        # Also save session if provided
+        # Auto-generate title from first user message (only the title field is read)
+        title = None
+        title_key = (user_id, conversation_id)
+        with conversation_title_lock:
+            known_title = conversation_title_cache.get(title_key)
+
+        if known_title:
+            title = known_title
+        elif role == 'user':
+            doc = conv_ref.get(field_paths=['title'])
+            if not doc.exists:
+                return jsonify({"success": False, "error": "Conversation not found"})
+            title = (doc.to_dict() or {}).get('title', 'New Chat')
+            if title == 'New Chat':
+                # Use first 40 chars of first message as title
+                title = content[:40] + ('...' if len(content) > 40 else '')
+                updates['title'] = title
+
+        # Also save session if provided (same write)
         session = data.get('session')
         if session:
-            conv_ref.update({'session': session})
+            updates['session'] = session
+
+        try:
+            conv_ref.update(updates)
+        except NotFound:
+            return jsonify({"success": False, "error": "Conversation not found"})
+
+        if title and title != 'New Chat' and not known_title:
+            with conversation_title_lock:
+                conversation_title_cache[title_key] = title
 
         return jsonify({"success": True, "title": title})
     except Exception as e:
-        print(f"Save message error: {e}")
+        logger.error("Save message error: %s", e)
         return jsonify({"success": False})
 
 
@@ -27,6 +27,9 @@ class SecurityConfig:
     RATE_LIMIT_DEFAULT = "100 per minute"
     RATE_LIMIT_CHAT = "30 per minute"
     RATE_LIMIT_AUTH = "10 per minute"
+    # Shared Redis counters keep limits global across gunicorn workers; memory:// is per-process (local dev)
+    RATE_LIMIT_STORAGE_URI = os.getenv('REDIS_URL', 'memory://')
+    RATE_LIMIT_STRATEGY = "moving-window"
     
     # Debug Mode - ALWAYS False in production
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -78,6 +81,10 @@ class SecurityConfig:
         return errors
 
 
+# Firebase UIDs are short URL-safe tokens
+_USER_ID_RE = re.compile(r'[a-zA-Z0-9_-]{1,128}')
+
+
 def validate_user_ownership(f):
     """
     Decorator to validate that the authenticated user has access to the requested resource.
@@ -98,7 +105,7 @@ def validate_user_ownership(f):
             return jsonify({"success": False, "error": "Authentication required"}), 401
         
         # Basic sanitization of user_id
-        if not re.match(r'^[a-zA-Z0-9_-]{1,128}$', user_id):
+        if not isinstance(user_id, str) or not _USER_ID_RE.fullmatch(user_id):
             return jsonify({"success": False, "error": "Invalid user ID format"}), 400
             
         # Store validated user_id in Flask g object for use in the route
@@ -174,8 +181,12 @@ def validate_numeric_input(value, min_val=None, max_val=None, default=None):
         return default
 
 
+# Headers never change after startup, so the pairs are materialized once
+_HEADER_ITEMS = tuple(SecurityConfig.SECURITY_HEADERS.items())
+
+
 def add_security_headers(response):
     """Add security headers to response."""
-    for header, value in SecurityConfig.SECURITY_HEADERS.items():
+    for header, value in _HEADER_ITEMS:
         response.headers[header] = value
     return response
@@ -8,6 +8,10 @@ class Config:
     # OpenRouter API Configuration (loaded from .env)
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
     AI_MODEL = os.getenv('OPENROUTER_MODEL', 'xiaomi/mimo-v2-flash')
+    # Intent classification is a short JSON task; point this at a small, fast model to cut NLU latency
+    NLU_MODEL = os.getenv('OPENROUTER_NLU_MODEL', AI_MODEL)
+    # Constrain NLU output with a json_schema response format; set to false for models that only do JSON mode
+    NLU_JSON_SCHEMA = os.getenv('OPENROUTER_NLU_JSON_SCHEMA', 'true').lower() == 'true'
     OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
     
     # Legacy Groq key (kept for reference)
@@ -15,6 +19,12 @@ class Config:
     
     FIREBASE_CREDENTIALS = "serviceAccountKey.json"
 
+    # Shared Redis (rate limits, cross-worker profile cache invalidation); unset = per-process only
+    REDIS_URL = os.getenv('REDIS_URL')
+
+    # Root log level (DEBUG shows per-request traces; WARNING keeps production output to problems)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+
     # Recommendation Weights (Moved from app.py for easy tuning)
     WEIGHTS = {
         'beginner': {'difficulty': 0.1, 'safety': 0.9},
@@ -9,6 +9,28 @@ def calculate_bmi(weight, height):
         return None
 
 
+# Daily calorie adjustment for the canonical goals the profile setup stores
+GOAL_ADJUSTMENT = {
+    'Weight Loss': -500,
+    'Muscle Gain': 300,
+    'Maintenance': 0
+}
+
+
+def goal_adjustment(goal):
+    """Calorie adjustment for a goal; free-text goals fall back to keyword matching."""
+    adjustment = GOAL_ADJUSTMENT.get(goal)
+    if adjustment is not None:
+        return adjustment
+
+    goal = goal or ''
+    if 'Loss' in goal or 'Cut' in goal:
+        return -500
+    if 'Gain' in goal or 'Muscle' in goal:
+        return 300
+    return 0
+
+
 def calculate_target_calories(weight, height, age, gender, goal):
     """
     Calculates daily target calories using Mifflin-St Jeor equation.
@@ -24,11 +46,6 @@ def calculate_target_calories(weight, height, age, gender, goal):
     tdee = bmr * 1.2
 
     # Goal Adjustment
-    if 'Loss' in goal or 'Cut' in goal:
-        target = tdee - 500
-    elif 'Gain' in goal or 'Muscle' in goal:
-        target = tdee + 300
-    else:
-        target = tdee
+    target = tdee + goal_adjustment(goal)
 
     return int(target)
\ No newline at end of file
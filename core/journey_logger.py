@@ -0,0 +1,77 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JourneyLogger:
+    """
+    Write-behind logger for the per-user 'journey_logs' analytics collection.
+    Entries are queued on the request thread and committed from a background
+    thread in Firestore batches, so logging never adds a round-trip to a reply.
+    """
+
+    MAX_BATCH = 500  # Firestore limit on writes per batch commit
+
+    def __init__(self, db_client, flush_interval=2.0, maxsize=10_000):
+        self.db = db_client
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+
+        if self.db:
+            threading.Thread(target=self._run, name='journey-logger', daemon=True).start()
+            atexit.register(self.flush)
+
+    def log(self, user_id, log_data):
+        """Queues a journey log entry. Drops (and warns) if the buffer is full."""
+        if not self.db:
+            return
+
+        try:
+            self._queue.put_nowait((user_id, log_data))
+        except queue.Full:
+            logger.warning("Journey log buffer full, dropping entry for %s", user_id)
+
+    def flush(self):
+        """Synchronously commits everything still buffered (used at shutdown)."""
+        items = self._drain()
+        while items:
+            self._commit(items)
+            items = self._drain()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Coalesce whatever arrives within the flush window into one commit
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(items)
+
+    def _drain(self):
+        items = []
+        while len(items) < self.MAX_BATCH:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _commit(self, items):
+        try:
+            batch = self.db.batch()
+            for user_id, log_data in items:
+                doc_ref = self.db.collection('users').document(user_id).collection('journey_logs').document()
+                batch.set(doc_ref, log_data)
+            batch.commit()
+        except Exception as e:
+            logger.error("Journey log commit error (%s entries): %s", len(items), e)
@@ -1,170 +1,528 @@
-import json
-from openai import OpenAI
+import logging
+import orjson
+import re
+import threading
+from itertools import islice
+import httpx
+from cachetools import LRUCache
+from openai import BadRequestError, OpenAI
 from config.settings import Config
+from core.response_formatter import format_log_confirmation
+
+logger = logging.getLogger(__name__)
+
+
+# --- FAST PATH ---
+# Whole-message patterns for unambiguous phrasings (logs, progress, single likes/dislikes,
+# resets, exercise how-tos, timetables, greetings), classified without an LLM round-trip.
+# Anything compound ("I like X, give me Y") or involving a Gold Standard item still goes to the LLM.
+FAST_WEIGHT_RE = re.compile(
+    r"(?:(?:i weigh|my weight is|log my weight:?|update my weight to)\s*(\d{2,3}(?:\.\d+)?)\s*(?:kgs?)?"
+    r"|(?:i'm|i am)\s*(\d{2,3}(?:\.\d+)?)\s*kgs?)"  # bare "I'm 25" is more likely an age
+    r"(?:\s+(?:today|now))?[.!]?",
+    re.IGNORECASE
+)
+FAST_PROGRESS_RE = re.compile(
+    r"(?:show|view)(?: me)? my (weight|workout|nutrition|calorie) (?:progress|history)[.!?]?",
+    re.IGNORECASE
+)
+FAST_TRACK_RE = re.compile(r"(?:track|show)(?: me)? my progress[.!?]?", re.IGNORECASE)
+FAST_PREFERENCE_RE = re.compile(
+    r"(?:actually,? )?i (like|love|prefer|enjoy|hate|dislike|don't like) ([a-z]+(?: [a-z]+)?)[.!]?",
+    re.IGNORECASE
+)
+FAST_CLEAR_RE = re.compile(
+    r"(?:please )?(?:clear|reset|remove)(?: all)?(?: of)?(?: my)? (?:preferences|likes and dislikes)[.!]?",
+    re.IGNORECASE
+)
+FAST_EXPLAIN_RE = re.compile(
+    r"how (?:do i|to|do you|should i) (?:do|perform) (?:a |an |the )?([a-z]+(?: [a-z]+){0,2}?)"
+    r"(?: correctly| properly)?[?.!]?",
+    re.IGNORECASE
+)
+FAST_TABLE_RE = re.compile(
+    r"(?:can you )?(?:please )?(?:make|create|build|give|show)(?: me)?(?: a| my)?(?: full)?"
+    r"(?: weekly(?: workout)? routine|(?: weekly)?(?: workout)? (?:timetable|schedule|table))"
+    r"(?: for me)?(?: please)?[.!?]?",
+    re.IGNORECASE
+)
+FAST_GREETING_RE = re.compile(
+    r"(?:hi|hello|hey|good (?:morning|afternoon|evening)|thanks|thank you|ok(?:ay)? thanks)(?: atlas)?[.!]*",
+    re.IGNORECASE
+)
+
+# Progress words mapped to the progress_type entity the progress handlers expect
+FAST_PROGRESS_TYPES = {'weight': 'weight', 'workout': 'workout', 'nutrition': 'nutrition', 'calorie': 'nutrition'}
+
+# Items the coach defends (coach_challenge) plus words the LLM strips from an item
+# ("I like to use X", "I like barbell exercises"); these messages go to the LLM
+FAST_PATH_EXCLUDED = frozenset({
+    'squats', 'squat', 'deadlifts', 'deadlift', 'burpees', 'burpee', 'hiit',
+    'bench press', 'high protein', 'to', 'using', 'eating', 'exercises', 'workouts', 'workout'
+})
+FAST_DISLIKE_VERBS = frozenset({'hate', 'dislike', "don't like"})
+
+# Pronouns/determiners: "I love it", "I hate this" are chat replies, not items to store
+FAST_PATH_PRONOUNS = frozenset({
+    'it', 'this', 'that', 'these', 'those', 'you', 'them', 'him', 'her',
+    'one', 'everything', 'nothing'
+})
+
+# NLU context budget (~300 tokens at ~4 chars/token), so a pasted wall of text can't bloat every call
+HISTORY_CHAR_BUDGET = 1200
+
+# Classification used when the LLM output is not valid JSON
+NLU_FALLBACK_JSON = '{"intent": "general_chat", "entities": {}}'
+
+
+def cache_text(text):
+    """Cache-key form of a message: case, spacing and trailing ?!. don't change the answer."""
+    return ' '.join(text.lower().split()).rstrip('?!. ')
+
+
+def trim_history(chat_history, max_turns=3, char_budget=HISTORY_CHAR_BUDGET):
+    """
+    Newest turns (oldest first) that fit the budget; an oversized turn keeps only its tail.
+    History comes from the client session, so roles are limited to user/assistant
+    (no injected system turns, no roles the API rejects) and content is forced to str.
+    """
+    turns = []
+    for turn in reversed(list(islice(chat_history, max(len(chat_history) - max_turns, 0), None))):
+        if char_budget <= 0:
+            break
+        if not isinstance(turn, dict):
+            continue
+        content = str(turn.get('content', ''))
+        if len(content) > char_budget:
+            content = content[-char_budget:]
+        char_budget -= len(content)
+        role = 'assistant' if turn.get('role') in ('assistant', 'ai') else 'user'
+        turns.append({'role': role, 'content': content})
+    turns.reverse()
+    return turns
+
+
+def fast_path_analysis(message):
+    """Returns an NLU result for unambiguous messages, or None to defer to the LLM."""
+    text = ' '.join(message.split())
+
+    match = FAST_WEIGHT_RE.fullmatch(text)
+    if match:
+        return {"intent": "log_weight", "entities": {"weight": float(match.group(1) or match.group(2))}}
+
+    match = FAST_PROGRESS_RE.fullmatch(text)
+    if match:
+        progress_type = FAST_PROGRESS_TYPES[match.group(1).lower()]
+        return {"intent": "view_progress", "entities": {"progress_type": progress_type}}
+
+    if FAST_TRACK_RE.fullmatch(text):
+        return {"intent": "view_progress", "entities": {"progress_type": "all"}}
+
+    if FAST_CLEAR_RE.fullmatch(text):
+        return {"intent": "clear_preferences", "entities": {}}
+
+    if FAST_TABLE_RE.fullmatch(text):
+        return {"intent": "workout_table", "entities": {}}
+
+    if FAST_GREETING_RE.fullmatch(text):
+        return {"intent": "general_chat", "entities": {}}
+
+    match = FAST_EXPLAIN_RE.fullmatch(text)
+    if match and not FAST_PATH_PRONOUNS.intersection(match.group(1).lower().split()):
+        return {"intent": "explain_exercise", "entities": {"target": match.group(1).title()}}
+
+    match = FAST_PREFERENCE_RE.fullmatch(text)
+    if match:
+        verb, item = match.group(1).lower(), match.group(2).lower()
+        words = item.split()
+        if item in FAST_PATH_EXCLUDED or words[0] in FAST_PATH_EXCLUDED or words[-1] in FAST_PATH_EXCLUDED:
+            return None
+        if FAST_PATH_PRONOUNS.intersection(words):
+            return None
+        if verb in FAST_DISLIKE_VERBS:
+            return {"intent": "add_dislike", "entities": {"dislikes": [item]}}
+        return {"intent": "add_preference", "entities": {"preferences": [item]}}
+
+    return None
+
+
+# Hardcoded Gold Standards for the coach persona to reference, pre-joined for the prompt
+GOLD_STANDARDS = {
+    'Weight Loss': 'HIIT, Burpees, Caloric Deficit, Fiber',
+    'Muscle Gain': 'Squats, Deadlifts, Bench Press, High Protein'
+}
+
+
+def render_option_buttons(options):
+    """Quick-reply buttons that send '<option> ideas' back to the chat."""
+    buttons = ''.join(
+        f"""<button onclick="sendQuick('{opt} ideas')" class="px-4 py-2 bg-brand-50 text-brand-600 rounded-full text-sm font-bold border border-brand-100 hover:bg-brand-600 hover:text-white transition-colors shadow-sm">{opt}</button>"""
+        for opt in options
+    )
+    return f'<div class="flex flex-wrap gap-2 mt-3">{buttons}</div>'
+
+
+# Meal-time buttons for vague nutrition questions, rendered once at import
+NUTRITION_OPTIONS_HTML = render_option_buttons(("Breakfast", "Lunch", "Dinner", "Snack"))
+NUTRITION_OPTIONS_LOSS_HTML = render_option_buttons(("Breakfast", "Lunch", "Dinner", "Low Calorie"))
+
+# Recipe diet for the canonical goals the profile setup stores
+GOAL_DIET = {
+    'Weight Loss': "low calorie, high volume",
+    'Muscle Gain': "high protein",
+    'Maintenance': "general"
+}
+
+# --- PROMPTS ---
+# Static system prompts live at module level so every request sends a byte-identical prefix
+# (providers behind OpenRouter reuse cached prefill for it); per-user details are appended last.
+NLU_SYSTEM_PROMPT = """
+You are the NLU brain for 'Atlas', a specialized AI Fitness & Nutrition Coach.
+Your Scope: STRICTLY Fitness, Exercise, Nutrition, Diet, Health, and Recovery.
+
+### PRIORITY RULES (Check in this exact order!)
+1. **PREFERENCE DETECTION (Check FIRST)**
+   - If message contains "I like", "I love", "I prefer", "I enjoy", "I'm a fan of" → `add_preference`
+   - If message contains "I hate", "I dislike", "I don't like", "not a fan of", "avoid", "no [food/exercise]" → `add_dislike`
+   - If message asks to "clear", "reset", or "remove" preferences → `clear_preferences`
+
+2. **COACH INTERVENTION (Check SECOND)**
+   - If user wants to "dislike", "avoid", "skip", or "hate" a Gold Standard item (Squats, Deadlifts, Burpees, HIIT, High Protein) → `coach_challenge`
+   - If user makes excuses like "it's too hard", "I'm tired", "don't like it" regarding top-tier exercises → `coach_challenge`
+
+3. **HEALTH QUESTIONS (Check THIRD - VERY IMPORTANT)**
+   - If message asks to "give me", "suggest", "recommend", "show me", "what should I" → recommendation intent
+   - If message has a question about how to do something → `explain_exercise`
+
+4. **FALLBACK** → Use other intents below
+
+### INTENT LIST (Pick ONE)
+- 'add_preference': User states what they LIKE. Keywords: "I like", "I love", "I prefer", "I enjoy"
+- 'add_dislike': User states what they DISLIKE. Keywords: "I hate", "I dislike", "I don't like", "avoid"
+- 'clear_preferences': User wants to RESET likes/dislikes.
+- 'general_chat': Greetings, motivation, OR **Health/Fitness QUESTIONS** (BMI, calories, weight goals, explanations).
+- 'nutrition_request': SPECIFIC food requests ("Breakfast ideas", "high protein meals").
+- 'nutrition_options': VAGUE food inquiries ("what should I eat?", "diet plan").
+- 'fitness_request': Workout requests ("chest exercises", "cardio routine").
+- 'fitness_variation': User wants a DIFFERENT exercise ("give me another", "something else").
+- 'nutrition_variation': User wants DIFFERENT food ("show me other options").
+- 'explain_exercise': User asks for instructions ("how to do X").
+- 'workout_table': User wants a WEEKLY WORKOUT TABLE/TIMETABLE/SCHEDULE. Keywords: "timetable", "schedule", "weekly plan", "5 days workout".
+- 'log_weight': User wants to LOG their weight. Keywords: "I weigh", "log weight", "my weight is", "update weight", "kg today".
+- 'log_nutrition': User wants to LOG food/calories/macros consumed. Keywords: "I ate", "log calories", "had X protein", "consumed", "intake".
+- 'log_workout': User wants to LOG a completed workout. Keywords: "finished workout", "completed", "log workout", "did my", "just did".
+- 'view_progress': User wants to VIEW their progress history. Keywords: "show progress", "my weight history", "calories today", "workout history", "how much", "track".
+- 'coach_challenge': User avoids or complains about critical, high-impact exercises/foods.
+- 'out_of_scope': NON-FITNESS topics OR GIBBERISH.
+
+### HEALTH QUESTION EXAMPLES (These are general_chat, NOT pathway_generation!)
+- "What is my BMI?" → {"intent": "general_chat", "entities": {}}
+- "What weight should I target for normal BMI?" → {"intent": "general_chat", "entities": {}}
+- "How many calories should I eat?" → {"intent": "general_chat", "entities": {}}
+- "I want to ask about my BMI if I want to target normal" → {"intent": "general_chat", "entities": {}}
+- "What are macros?" → {"intent": "general_chat", "entities": {}}
+- "How do I lose weight?" → {"intent": "general_chat", "entities": {}}
+
+### WORKOUT TABLE EXAMPLES (These ARE workout_table - weekly schedules)
+- "Make me a weekly workout table" → {"intent": "workout_table", "entities": {"workout_days": 5, "rest_days": 2}}
+- "5 days workout 2 days rest timetable" → {"intent": "workout_table", "entities": {"workout_days": 5, "rest_days": 2}}
+- "Can you make a full timetable for me" → {"intent": "workout_table", "entities": {}}
+- "Create my workout schedule" → {"intent": "workout_table", "entities": {}}
+- "Show me a weekly routine" → {"intent": "workout_table", "entities": {}}
+
+### CRITICAL EXAMPLES (Preference vs Request)
+- "I like chicken" → {"intent": "add_preference", "entities": {"preferences": ["chicken"]}}
+- "I love running" → {"intent": "add_preference", "entities": {"preferences": ["running"]}}
+- "I prefer vegan food" → {"intent": "add_preference", "entities": {"preferences": ["vegan food"]}}
+- "I like to use dumbbell" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"]}}
+- "I like to use dumbbell for workout" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"]}}
+- "I like using resistance bands" → {"intent": "add_preference", "entities": {"preferences": ["resistance bands"]}}
+- "I like barbell exercises" → {"intent": "add_preference", "entities": {"preferences": ["barbell"]}}
+- "I prefer bodyweight exercises" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"]}}
+- "I enjoy kettlebell workouts" → {"intent": "add_preference", "entities": {"preferences": ["kettlebell"]}}
+
+### DISLIKE EXAMPLES (These should ALL be add_dislike, NOT fitness_request!)
+- "I don't like burpees" → {"intent": "add_dislike", "entities": {"dislikes": ["burpees"]}}
+- "I hate fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
+- "I hate using kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
+- "I don't like to use kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
+- "I hate kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
+- "I don't like machines" → {"intent": "add_dislike", "entities": {"dislikes": ["machines"]}}
+- "I hate cardio" → {"intent": "add_dislike", "entities": {"dislikes": ["cardio"]}}
+- "I don't like eating fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
+- "I hate to eat fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
+- "Not a fan of cardio" → {"intent": "add_dislike", "entities": {"dislikes": ["cardio"]}}
+- "Actually, I prefer yoga" → {"intent": "add_preference", "entities": {"preferences": ["yoga"]}}
+
+### PURE PREFERENCE/DISLIKE COMBINATIONS (NO explicit request = add_preference or add_dislike!)
+- "I don't like kettlebell and hate fish" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell", "fish"]}}
+- "I don't like to use kettlebell and hate to eat fish" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell", "fish"]}}
+- "I like dumbbell and hate kettlebell" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"], "dislikes": ["kettlebell"]}}
+- "I prefer chicken but hate fish" → {"intent": "add_preference", "entities": {"preferences": ["chicken"], "dislikes": ["fish"]}}
+
+### REQUEST EXAMPLES (These are NOT preferences - they ask for something specific)
+- "Give me chest exercises" → {"intent": "fitness_request", "entities": {"target": "Chest"}}
+- "Suggest high protein meals" → {"intent": "nutrition_request", "entities": {"target": "High Protein"}}
+- "I want a workout for legs" → {"intent": "fitness_request", "entities": {"target": "Legs"}}
+- "Show me breakfast ideas" → {"intent": "nutrition_request", "entities": {"target": "Breakfast"}}
+- "Something else please" → {"intent": "fitness_variation" or "nutrition_variation"}
+
+### COMPOUND EXAMPLES (CRITICAL - Extract ALL preferences/dislikes even in requests!)
+- "I like chicken, give me recipes" → {"intent": "nutrition_request", "entities": {"target": "chicken", "preferences": ["chicken"]}}
+- "I like kettlebell and chicken" → {"intent": "add_preference", "entities": {"preferences": ["kettlebell", "chicken"]}}
+- "I like kettlebell but hate barbell, suggest abs workout" → {"intent": "fitness_request", "entities": {"target": "Abs", "preferences": ["kettlebell"], "dislikes": ["barbell"]}}
+- "I prefer dumbbells but don't like machines. Give me chest exercises" → {"intent": "fitness_request", "entities": {"target": "Chest", "preferences": ["dumbbells"], "dislikes": ["machines"]}}
+- "I hate cardio but love strength training, show me workouts" → {"intent": "fitness_request", "entities": {"target": "General", "preferences": ["strength training"], "dislikes": ["cardio"]}}
+- "No fish please, suggest me high protein dinner" → {"intent": "nutrition_request", "entities": {"target": "High Protein Dinner", "dislikes": ["fish"]}}
+- "I avoid dairy, give me breakfast ideas" → {"intent": "nutrition_request", "entities": {"target": "Breakfast", "dislikes": ["dairy"]}}
+
+### PROGRESS TRACKING EXAMPLES (NEW!)
+- "I weigh 75kg today" → {"intent": "log_weight", "entities": {"weight": 75}}
+- "Log my weight: 80" → {"intent": "log_weight", "entities": {"weight": 80}}
+- "My weight is 68.5 kg" → {"intent": "log_weight", "entities": {"weight": 68.5}}
+- "Right now my weight is 70kg and what is my bmi?" → {"intent": "log_weight", "entities": {"weight": 70, "ask_bmi": true}}
+- "My weight is 65kg, calculate my bmi" → {"intent": "log_weight", "entities": {"weight": 65, "ask_bmi": true}}
+- "I'm 80kg now, what's my BMI?" → {"intent": "log_weight", "entities": {"weight": 80, "ask_bmi": true}}
+- "Update my weight to 72kg and show my BMI" → {"intent": "log_weight", "entities": {"weight": 72, "ask_bmi": true}}
+- "I ate 500 calories" → {"intent": "log_nutrition", "entities": {"calories": 500}}
+- "Log 50g protein" → {"intent": "log_nutrition", "entities": {"protein": 50}}
+- "Had 300 calories and 30g protein" → {"intent": "log_nutrition", "entities": {"calories": 300, "protein": 30}}
+- "I consumed 40g carbs" → {"intent": "log_nutrition", "entities": {"carbs": 40}}
+- "I finished my Chest workout" → {"intent": "log_workout", "entities": {"workout_name": "Chest"}}
+- "Just completed leg day" → {"intent": "log_workout", "entities": {"workout_name": "Leg"}}
+- "Log my back workout" → {"intent": "log_workout", "entities": {"workout_name": "Back"}}
+- "Show my weight progress" → {"intent": "view_progress", "entities": {"progress_type": "weight"}}
+- "How many calories have I eaten today?" → {"intent": "view_progress", "entities": {"progress_type": "nutrition"}}
+- "Show my workout history" → {"intent": "view_progress", "entities": {"progress_type": "workout"}}
+- "What's my calorie intake today?" → {"intent": "view_progress", "entities": {"progress_type": "nutrition"}}
+- "Track my progress" → {"intent": "view_progress", "entities": {"progress_type": "all"}}
+
+### NO EQUIPMENT / HOME WORKOUT EXAMPLES (IMPORTANT!)
+- "I don't have any equipment" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
+- "I workout at home" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
+- "I don't have gym equipment" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
+- "No gym, just home workouts" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
+- "I only have my body, no weights" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
+- "Give me exercises without equipment" → {"intent": "fitness_request", "entities": {"target": "General", "no_equipment": true}}
+- "Bodyweight exercises for chest" → {"intent": "fitness_request", "entities": {"target": "Chest", "no_equipment": true}}
+- "Home workout for legs" → {"intent": "fitness_request", "entities": {"target": "Legs", "no_equipment": true}}
+
+### OUTPUT FORMAT
+JSON ONLY, following the response schema. Include only the entities the message actually mentions.
+"""
+
+# Plain JSON mode has no schema to decode against, so the shape goes back into the prompt
+NLU_JSON_MODE_PROMPT = NLU_SYSTEM_PROMPT + """Shape: {"intent": "string", "entities": {"target": "string or null", "preferences": [], "dislikes": [], "no_equipment": "boolean or null", "category": "string or null", "weight": "number or null", "ask_bmi": "boolean", "calories": "number or null", "protein": "number or null", "carbs": "number or null", "fat": "number or null", "workout_name": "string or null", "workout_days": "integer", "rest_days": "integer", "progress_type": "weight|nutrition|workout|all or null"}}
+"""
+
+# Structured output for analyze_message: the provider constrains decoding to this shape,
+# so the prompt no longer spells the format out. Not strict, so unused entities are simply omitted.
+NLU_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "nlu_analysis",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intent": {
+                    "type": "string",
+                    "enum": [
+                        "add_preference", "add_dislike", "clear_preferences", "general_chat",
+                        "nutrition_request", "nutrition_options", "fitness_request",
+                        "fitness_variation", "nutrition_variation", "explain_exercise",
+                        "workout_table", "log_weight", "log_nutrition", "log_workout",
+                        "view_progress", "coach_challenge", "out_of_scope"
+                    ]
+                },
+                "entities": {
+                    "type": "object",
+                    "properties": {
+                        "target": {"type": ["string", "null"]},
+                        "preferences": {"type": "array", "items": {"type": "string"}},
+                        "dislikes": {"type": "array", "items": {"type": "string"}},
+                        "no_equipment": {"type": ["boolean", "null"]},
+                        "category": {"type": ["string", "null"]},
+                        "weight": {"type": ["number", "null"]},
+                        "ask_bmi": {"type": "boolean"},
+                        "calories": {"type": ["number", "null"]},
+                        "protein": {"type": ["number", "null"]},
+                        "carbs": {"type": ["number", "null"]},
+                        "fat": {"type": ["number", "null"]},
+                        "workout_name": {"type": ["string", "null"]},
+                        "workout_days": {"type": "integer"},
+                        "rest_days": {"type": "integer"},
+                        "progress_type": {"enum": ["weight", "nutrition", "workout", "all", None]}
+                    }
+                }
+            },
+            "required": ["intent", "entities"]
+        }
+    }
+}
+
+COACH_SYSTEM_PROMPT = """
+You are Atlas, an Empathetic Performance Coach.
+Your job is to be the user's friendly partner in success.
+
+### KEY PERSONA TRAITS:
+- **Tone:** Mature, friendly, warm, yet disciplined. Use "We" language (e.g., "Let's reach our goal", "We can handle this").
+- **Philosophy:** Trust is built on understanding, but Progress is built on Truth.
+- **Strategy:** Validate -> Challenge -> Support.
+
+### INTERVENTION STRUCTURE:
+1. **Validate:** Acknowledge their feeling (e.g., "I know squats are brutal," "It's normal to feel tired.").
+2. **The Truth (Pivot):** Gently explain why avoiding this hurts **OUR** goal (e.g., "But skipping leg day limits our total metabolism.").
+3. **Micro-Challenge:** Offer a compromise (e.g., "Let's just do 2 sets today?" or "What if we swap it for Leg Press just for today?").
+4. **Closing:** A warm confident nudge (e.g., "I know you've got this.").
+
+**OUTPUT FORMAT:** HTML ONLY. Use <b>bold</b> and <br> for structure. NO markdown blocks.
+"""
+
+RESPONSE_SYSTEM_PROMPT = """
+You are Atlas, an Empathetic Performance Coach.
+
+**CRITICAL RESPONSE RULES (READ CAREFULLY!):**
+1. **ONLY answer what was asked** - Do NOT volunteer extra information!
+2. **For simple messages (greetings, thanks, acknowledgments):** Give a SHORT 1-2 sentence response. Do NOT provide unsolicited advice or workout plans!
+3. **MAX LENGTH: 50-100 words** for simple chats, up to 150 words ONLY if explaining something complex.
+4. **NO UNPROMPTED ADVICE** - If user says "thank you", just say "You're welcome!" - do NOT give workout plans!
+
+**EXAMPLES OF CORRECT RESPONSES:**
+- User: "Thank you" → "You're welcome! Let me know if you need anything else. 💪"
+- User: "Hi Atlas" → "Hey there! How can I help with your fitness journey today?"
+- User: "Ok thanks" → "Anytime! I'm here when you need me."
+
+**FORMATTING RULES:**
+1. **Use HTML tags** - Use <b>bold</b> for emphasis. Use <br> for line breaks SPARINGLY.
+2. **NO EXCESSIVE SPACING** - Maximum 1 <br> between sections.
+3. **Bullet lists:** Use plain dashes (-) or bullets (•). Keep them tight.
+4. **NO MARKDOWN** - Don't use **, ##, or ``` - use HTML only.
+
+**FOR QUESTIONS THAT NEED ANSWERS:**
+1. **Start with a direct answer** - no fluffy introductions.
+2. **Use Profile Data:** For BMI/weight questions, CALCULATE using EXACT numbers from profile.
+3. **BMI Formula:** BMI = weight(kg) / (height(m))^2
+4. **Tone:** Professional, encouraging. Use "We" language.
+
+**FOR EXERCISE EXPLANATIONS (ONLY if asked!):**
+<b>[Exercise Name]</b><br>
+• [Key point 1]<br>
+• [Key point 2]<br>
+• [Key point 3]<br>
+<b>Tip:</b> [One common mistake to avoid]
+
+- ONLY 3-4 bullet points maximum
+- NO lengthy introductions or conclusions
+- If YouTube link requested: <br><a href="https://www.youtube.com/results?search_query=[EXERCISE]+tutorial" target="_blank" class="inline-flex items-center gap-2 px-4 py-2 bg-red-600 hover:bg-red-700 text-white rounded-lg font-bold transition-colors"><i class="fab fa-youtube"></i> Watch Tutorial</a>
+"""
+
+RECIPE_SYSTEM_PROMPT = """
+You are a Michelin-star fitness chef.
+
+**OUTPUT FORMAT (HTML ONLY):**
+Return the raw HTML inside a `<div>`. Do not use markdown blocks.
+
+Structure & Design (Use Tailwind Classes for light/dark mode):
+
+1. **Recipe Header:**
+   - Use a `<div>` with `p-6 bg-slate-50 dark:bg-slate-900 border-b border-slate-100 dark:border-slate-700`.
+   - Title `<h3>` with `text-2xl font-black text-slate-800 dark:text-white mb-2 flex items-center gap-2`. Start with a relevant emoji.
+   - Description `<p>` with `text-sm text-slate-500 dark:text-slate-400 italic`.
+
+2. **Ingredients Section:**
+   - Use a `<div>` with `p-6 bg-white dark:bg-slate-800`.
+   - Header `<h4>` with `font-bold text-slate-700 dark:text-slate-200 uppercase tracking-wider text-xs mb-4 flex items-center gap-2`. Use `<i class="fas fa-shopping-basket text-brand-500"></i>`.
+   - List `<ul>` with `space-y-2`.
+   - Items `<li>` with `flex items-start gap-2 text-sm text-slate-600 dark:text-slate-300`. Use `<span class="text-brand-500 font-bold">•</span>` as bullet.
+
+3. **Instructions Section:**
+   - Use a `<div>` with `p-6 pt-0 bg-white dark:bg-slate-800`.
+   - Header `<h4>` with `font-bold text-slate-700 dark:text-slate-200 uppercase tracking-wider text-xs mb-4 flex items-center gap-2`. Use `<i class="fas fa-list-ol text-brand-500"></i>`.
+   - List `<ol>` with `space-y-4`.
+   - Items `<li>` with `flex gap-3 text-sm text-slate-600 dark:text-slate-300`. Use `<span class="w-6 h-6 rounded-full bg-brand-100 dark:bg-brand-900/30 text-brand-600 dark:text-brand-400 text-xs font-bold flex items-center justify-center shrink-0">1</span>` for numbered circles.
+
+4. **Chef's Tip (at the end):**
+   - Use a `<div>` with `mx-6 mb-6 p-4 bg-emerald-50 dark:bg-emerald-900/20 text-emerald-700 dark:text-emerald-300 rounded-xl text-sm border border-emerald-100 dark:border-emerald-800/30 flex gap-3 items-start`.
+   - Icon: `<i class="fas fa-lightbulb text-emerald-500 mt-0.5"></i>`.
+   - Content: `<span><b class="text-emerald-700 dark:text-emerald-300">Chef's Tip:</b> ...</span>`.
+
+IMPORTANT: Output ONLY the HTML. No markdown, no explanation.
+"""
 
 
 class SmartNLUEngine:
     def __init__(self):
-        self.client = OpenAI(
-            base_url=Config.OPENROUTER_BASE_URL,
-            api_key=Config.OPENROUTER_API_KEY,
-        )
+        # Built on first use (see client) so app start doesn't pay for the HTTP/TLS setup
+        self._client = None
+        self._client_lock = threading.Lock()
+
+        # Memoized LLM outputs keyed on normalized input (repeat phrasings skip the round-trip)
+        self._analysis_cache = LRUCache(maxsize=8192)
+        self._reply_cache = LRUCache(maxsize=2048)
+        self._recipe_cache = LRUCache(maxsize=1024)
+        self._cache_lock = threading.Lock()
+
+        # Cleared the first time the provider rejects json_schema, so later calls go straight to JSON mode
+        self._use_json_schema = Config.NLU_JSON_SCHEMA
+
+    @property
+    def client(self):
+        """OpenRouter client, created once on first use and shared by all threads."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # One keep-alive HTTP/2 pool shared by every gthread worker thread: repeat calls skip TCP/TLS setup
+                    self._client = OpenAI(
+                        base_url=Config.OPENROUTER_BASE_URL,
+                        api_key=Config.OPENROUTER_API_KEY,
+                        http_client=httpx.Client(
+                            http2=True,
+                            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                            timeout=httpx.Timeout(60.0, connect=5.0)
+                        )
+                    )
+        return self._client
+
+    def clear_cache(self):
+        """Drops memoized classifications and replies (e.g. after a prompt or model change)."""
+        with self._cache_lock:
+            self._analysis_cache.clear()
+            self._reply_cache.clear()
+            self._recipe_cache.clear()
 
     def analyze_message(self, message, chat_history):
         """
         Analyzes the user message to determine intent and extract entities.
         Optimized to detect preferences, feedback, vague queries, and out-of-scope topics.
+        chat_history is any sized iterable of {"role", "content"} turns (list or bounded deque).
         """
-        system_prompt = """
-        You are the NLU brain for 'Atlas', a specialized AI Fitness & Nutrition Coach.
-        Your Scope: STRICTLY Fitness, Exercise, Nutrition, Diet, Health, and Recovery.
-
-        ### PRIORITY RULES (Check in this exact order!)
-        1. **PREFERENCE DETECTION (Check FIRST)**
-           - If message contains "I like", "I love", "I prefer", "I enjoy", "I'm a fan of" → `add_preference`
-           - If message contains "I hate", "I dislike", "I don't like", "not a fan of", "avoid", "no [food/exercise]" → `add_dislike`
-           - If message asks to "clear", "reset", or "remove" preferences → `clear_preferences`
-        
-        2. **COACH INTERVENTION (Check SECOND)**
-           - If user wants to "dislike", "avoid", "skip", or "hate" a Gold Standard item (Squats, Deadlifts, Burpees, HIIT, High Protein) → `coach_challenge`
-           - If user makes excuses like "it's too hard", "I'm tired", "don't like it" regarding top-tier exercises → `coach_challenge`
-        
-        3. **HEALTH QUESTIONS (Check THIRD - VERY IMPORTANT)**
-           - If message asks to "give me", "suggest", "recommend", "show me", "what should I" → recommendation intent
-           - If message has a question about how to do something → `explain_exercise`
-        
-        4. **FALLBACK** → Use other intents below
-
-        ### INTENT LIST (Pick ONE)
-        - 'add_preference': User states what they LIKE. Keywords: "I like", "I love", "I prefer", "I enjoy"
-        - 'add_dislike': User states what they DISLIKE. Keywords: "I hate", "I dislike", "I don't like", "avoid"
-        - 'clear_preferences': User wants to RESET likes/dislikes.
-        - 'general_chat': Greetings, motivation, OR **Health/Fitness QUESTIONS** (BMI, calories, weight goals, explanations).
-        - 'nutrition_request': SPECIFIC food requests ("Breakfast ideas", "high protein meals").
-        - 'nutrition_options': VAGUE food inquiries ("what should I eat?", "diet plan").
-        - 'fitness_request': Workout requests ("chest exercises", "cardio routine").
-        - 'fitness_variation': User wants a DIFFERENT exercise ("give me another", "something else").
-        - 'nutrition_variation': User wants DIFFERENT food ("show me other options").
-        - 'explain_exercise': User asks for instructions ("how to do X").
-        - 'workout_table': User wants a WEEKLY WORKOUT TABLE/TIMETABLE/SCHEDULE. Keywords: "timetable", "schedule", "weekly plan", "5 days workout".
-        - 'log_weight': User wants to LOG their weight. Keywords: "I weigh", "log weight", "my weight is", "update weight", "kg today".
-        - 'log_nutrition': User wants to LOG food/calories/macros consumed. Keywords: "I ate", "log calories", "had X protein", "consumed", "intake".
-        - 'log_workout': User wants to LOG a completed workout. Keywords: "finished workout", "completed", "log workout", "did my", "just did".
-        - 'view_progress': User wants to VIEW their progress history. Keywords: "show progress", "my weight history", "calories today", "workout history", "how much", "track".
-        - 'coach_challenge': User avoids or complains about critical, high-impact exercises/foods.
-        - 'out_of_scope': NON-FITNESS topics OR GIBBERISH.
-
-        ### HEALTH QUESTION EXAMPLES (These are general_chat, NOT pathway_generation!)
-        - "What is my BMI?" → {"intent": "general_chat", "entities": {}}
-        - "What weight should I target for normal BMI?" → {"intent": "general_chat", "entities": {}}
-        - "How many calories should I eat?" → {"intent": "general_chat", "entities": {}}
-        - "I want to ask about my BMI if I want to target normal" → {"intent": "general_chat", "entities": {}}
-        - "What are macros?" → {"intent": "general_chat", "entities": {}}
-        - "How do I lose weight?" → {"intent": "general_chat", "entities": {}}
-        
-        ### WORKOUT TABLE EXAMPLES (These ARE workout_table - weekly schedules)
-        - "Make me a weekly workout table" → {"intent": "workout_table", "entities": {"workout_days": 5, "rest_days": 2}}
-        - "5 days workout 2 days rest timetable" → {"intent": "workout_table", "entities": {"workout_days": 5, "rest_days": 2}}
-        - "Can you make a full timetable for me" → {"intent": "workout_table", "entities": {}}
-        - "Create my workout schedule" → {"intent": "workout_table", "entities": {}}
-        - "Show me a weekly routine" → {"intent": "workout_table", "entities": {}}
-
-        ### CRITICAL EXAMPLES (Preference vs Request)
-        - "I like chicken" → {"intent": "add_preference", "entities": {"preferences": ["chicken"]}}
-        - "I love running" → {"intent": "add_preference", "entities": {"preferences": ["running"]}}
-        - "I prefer vegan food" → {"intent": "add_preference", "entities": {"preferences": ["vegan food"]}}
-        - "I like to use dumbbell" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"]}}
-        - "I like to use dumbbell for workout" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"]}}
-        - "I like using resistance bands" → {"intent": "add_preference", "entities": {"preferences": ["resistance bands"]}}
-        - "I like barbell exercises" → {"intent": "add_preference", "entities": {"preferences": ["barbell"]}}
-        - "I prefer bodyweight exercises" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"]}}
-        - "I enjoy kettlebell workouts" → {"intent": "add_preference", "entities": {"preferences": ["kettlebell"]}}
-        
-        ### DISLIKE EXAMPLES (These should ALL be add_dislike, NOT fitness_request!)
-        - "I don't like burpees" → {"intent": "add_dislike", "entities": {"dislikes": ["burpees"]}}
-        - "I hate fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
-        - "I hate using kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
-        - "I don't like to use kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
-        - "I hate kettlebell" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell"]}}
-        - "I don't like machines" → {"intent": "add_dislike", "entities": {"dislikes": ["machines"]}}
-        - "I hate cardio" → {"intent": "add_dislike", "entities": {"dislikes": ["cardio"]}}
-        - "I don't like eating fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
-        - "I hate to eat fish" → {"intent": "add_dislike", "entities": {"dislikes": ["fish"]}}
-        - "Not a fan of cardio" → {"intent": "add_dislike", "entities": {"dislikes": ["cardio"]}}
-        - "Actually, I prefer yoga" → {"intent": "add_preference", "entities": {"preferences": ["yoga"]}}
-        
-        ### PURE PREFERENCE/DISLIKE COMBINATIONS (NO explicit request = add_preference or add_dislike!)
-        - "I don't like kettlebell and hate fish" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell", "fish"]}}
-        - "I don't like to use kettlebell and hate to eat fish" → {"intent": "add_dislike", "entities": {"dislikes": ["kettlebell", "fish"]}}
-        - "I like dumbbell and hate kettlebell" → {"intent": "add_preference", "entities": {"preferences": ["dumbbell"], "dislikes": ["kettlebell"]}}
-        - "I prefer chicken but hate fish" → {"intent": "add_preference", "entities": {"preferences": ["chicken"], "dislikes": ["fish"]}}
-        
-        ### REQUEST EXAMPLES (These are NOT preferences - they ask for something specific)
-        - "Give me chest exercises" → {"intent": "fitness_request", "entities": {"target": "Chest"}}
-        - "Suggest high protein meals" → {"intent": "nutrition_request", "entities": {"target": "High Protein"}}
-        - "I want a workout for legs" → {"intent": "fitness_request", "entities": {"target": "Legs"}}
-        - "Show me breakfast ideas" → {"intent": "nutrition_request", "entities": {"target": "Breakfast"}}
-        - "Something else please" → {"intent": "fitness_variation" or "nutrition_variation"}
-
-        ### COMPOUND EXAMPLES (CRITICAL - Extract ALL preferences/dislikes even in requests!)
-        - "I like chicken, give me recipes" → {"intent": "nutrition_request", "entities": {"target": "chicken", "preferences": ["chicken"]}}
-        - "I like kettlebell and chicken" → {"intent": "add_preference", "entities": {"preferences": ["kettlebell", "chicken"]}}
-        - "I like kettlebell but hate barbell, suggest abs workout" → {"intent": "fitness_request", "entities": {"target": "Abs", "preferences": ["kettlebell"], "dislikes": ["barbell"]}}
-        - "I prefer dumbbells but don't like machines. Give me chest exercises" → {"intent": "fitness_request", "entities": {"target": "Chest", "preferences": ["dumbbells"], "dislikes": ["machines"]}}
-        - "I hate cardio but love strength training, show me workouts" → {"intent": "fitness_request", "entities": {"target": "General", "preferences": ["strength training"], "dislikes": ["cardio"]}}
-        - "No fish please, suggest me high protein dinner" → {"intent": "nutrition_request", "entities": {"target": "High Protein Dinner", "dislikes": ["fish"]}}
-        - "I avoid dairy, give me breakfast ideas" → {"intent": "nutrition_request", "entities": {"target": "Breakfast", "dislikes": ["dairy"]}}
-
-        ### PROGRESS TRACKING EXAMPLES (NEW!)
-        - "I weigh 75kg today" → {"intent": "log_weight", "entities": {"weight": 75}}
-        - "Log my weight: 80" → {"intent": "log_weight", "entities": {"weight": 80}}
-        - "My weight is 68.5 kg" → {"intent": "log_weight", "entities": {"weight": 68.5}}
-        - "Right now my weight is 70kg and what is my bmi?" → {"intent": "log_weight", "entities": {"weight": 70, "ask_bmi": true}}
-        - "My weight is 65kg, calculate my bmi" → {"intent": "log_weight", "entities": {"weight": 65, "ask_bmi": true}}
-        - "I'm 80kg now, what's my BMI?" → {"intent": "log_weight", "entities": {"weight": 80, "ask_bmi": true}}
-        - "Update my weight to 72kg and show my BMI" → {"intent": "log_weight", "entities": {"weight": 72, "ask_bmi": true}}
-        - "I ate 500 calories" → {"intent": "log_nutrition", "entities": {"calories": 500}}
-        - "Log 50g protein" → {"intent": "log_nutrition", "entities": {"protein": 50}}
-        - "Had 300 calories and 30g protein" → {"intent": "log_nutrition", "entities": {"calories": 300, "protein": 30}}
-        - "I consumed 40g carbs" → {"intent": "log_nutrition", "entities": {"carbs": 40}}
-        - "I finished my Chest workout" → {"intent": "log_workout", "entities": {"workout_name": "Chest"}}
-        - "Just completed leg day" → {"intent": "log_workout", "entities": {"workout_name": "Leg"}}
-        - "Log my back workout" → {"intent": "log_workout", "entities": {"workout_name": "Back"}}
-        - "Show my weight progress" → {"intent": "view_progress", "entities": {"progress_type": "weight"}}
-        - "How many calories have I eaten today?" → {"intent": "view_progress", "entities": {"progress_type": "nutrition"}}
-        - "Show my workout history" → {"intent": "view_progress", "entities": {"progress_type": "workout"}}
-        - "What's my calorie intake today?" → {"intent": "view_progress", "entities": {"progress_type": "nutrition"}}
-        - "Track my progress" → {"intent": "view_progress", "entities": {"progress_type": "all"}}
-
-        ### NO EQUIPMENT / HOME WORKOUT EXAMPLES (IMPORTANT!)
-        - "I don't have any equipment" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
-        - "I workout at home" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
-        - "I don't have gym equipment" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
-        - "No gym, just home workouts" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
-        - "I only have my body, no weights" → {"intent": "add_preference", "entities": {"preferences": ["bodyweight"], "no_equipment": true}}
-        - "Give me exercises without equipment" → {"intent": "fitness_request", "entities": {"target": "General", "no_equipment": true}}
-        - "Bodyweight exercises for chest" → {"intent": "fitness_request", "entities": {"target": "Chest", "no_equipment": true}}
-        - "Home workout for legs" → {"intent": "fitness_request", "entities": {"target": "Legs", "no_equipment": true}}
-
-        ### OUTPUT FORMAT (JSON ONLY)
-        {"intent": "string", "entities": {"target": "string or null", "preferences": [], "dislikes": [], "no_equipment": "boolean or null", "category": "string or null", "weight": "number or null", "calories": "number or null", "protein": "number or null", "carbs": "number or null", "fat": "number or null", "workout_name": "string or null", "progress_type": "weight|nutrition|workout|all or null"}}
-        """
+        fast_result = fast_path_analysis(message)
+        if fast_result is not None:
+            return fast_result
 
         try:
-            # Context window management
-            context_str = json.dumps(chat_history[-3:]) if chat_history else "[]"
-
-            response = self.client.chat.completions.create(
-                model=Config.AI_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Context: {context_str}\nUser Message: {message}"}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1,
-                max_tokens=1024
-            )
-            result = json.loads(response.choices[0].message.content)
+            # Context window management: recent turns go to the model as real chat messages
+            recent_turns = trim_history(chat_history) if chat_history else []
+            context = tuple((turn['role'], turn['content']) for turn in recent_turns)
+
+            cache_key = (cache_text(message), context)
+            with self._cache_lock:
+                raw = self._analysis_cache.get(cache_key)
+
+            if raw is None:
+                raw = self._classify(message, recent_turns)
+                try:
+                    result = orjson.loads(raw)
+                except (TypeError, ValueError):
+                    # Cache unparseable output as the fallback so repeat gibberish skips the API
+                    logger.warning("NLU returned unparseable output for %r", message)
+                    raw = NLU_FALLBACK_JSON
+                    result = orjson.loads(raw)
+                with self._cache_lock:
+                    self._analysis_cache[cache_key] = raw
+            else:
+                result = orjson.loads(raw)
 
             # Normalization logic
             entities = result.get('entities', {})
@@ -178,49 +536,48 @@ class SmartNLUEngine:
             # Debug log for preference detection
             intent = result.get('intent')
             if intent in ['add_preference', 'add_dislike']:
-                print(f"[NLU] Preference detected - Intent: {intent}, Entities: {entities}")
+                logger.debug("Preference detected - Intent: %s, Entities: %s", intent, entities)
             
             return result
 
         except Exception as e:
-            print(f"NLU Error: {e}")
+            logger.warning("NLU error: %s", e)
             return {"intent": "general_chat", "entities": {}}
 
+    def _classify(self, message, recent_turns):
+        """Raw NLU JSON, retried in plain JSON mode if the model rejects the response schema."""
+        if self._use_json_schema:
+            try:
+                return self._request_classification(message, recent_turns, NLU_SYSTEM_PROMPT, NLU_RESPONSE_FORMAT)
+            except BadRequestError as e:
+                logger.warning("NLU model rejected json_schema, using JSON mode: %s", e)
+                self._use_json_schema = False
+        return self._request_classification(message, recent_turns, NLU_JSON_MODE_PROMPT, {"type": "json_object"})
+
+    def _request_classification(self, message, recent_turns, system_prompt, response_format):
+        response = self.client.chat.completions.create(
+            model=Config.NLU_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *recent_turns,
+                {"role": "user", "content": message}
+            ],
+            response_format=response_format,
+            temperature=0.1,
+            max_tokens=256  # JSON intent + a few entities
+        )
+        return response.choices[0].message.content
+
     def _get_coach_intervention(self, message, profile):
         """Generates an 'Empathetic Performance Coach' persona response to challenge the user."""
         name = profile.get('name', 'Friend')
         goal = profile.get('goal', 'Maintenance')
-        
-        # Hardcoded Gold Standards for the persona to reference
-        gold_standards = {
-            'Weight Loss': ['HIIT', 'Burpees', 'Caloric Deficit', 'Fiber'],
-            'Muscle Gain': ['Squats', 'Deadlifts', 'Bench Press', 'High Protein']
-        }
-        
-        relevant_standards = []
-        for k, v in gold_standards.items():
-            if k in goal: relevant_standards.extend(v)
-
-        system_prompt = f"""
-        You are Atlas, an Empathetic Performance Coach.
-        Your job is to be the user's friendly partner in success.
-        
-        ### KEY PERSONA TRAITS:
-        - **Tone:** Mature, friendly, warm, yet disciplined. Use "We" language (e.g., "Let's reach our goal", "We can handle this").
-        - **Philosophy:** Trust is built on understanding, but Progress is built on Truth.
-        - **Strategy:** Validate -> Challenge -> Support.
-
-        ### INTERVENTION STRUCTURE:
-        1. **Validate:** Acknowledge their feeling (e.g., "I know squats are brutal," "It's normal to feel tired.").
-        2. **The Truth (Pivot):** Gently explain why avoiding this hurts **OUR** goal (e.g., "But skipping leg day limits our total metabolism.").
-        3. **Micro-Challenge:** Offer a compromise (e.g., "Let's just do 2 sets today?" or "What if we swap it for Leg Press just for today?").
-        4. **Closing:** A warm confident nudge (e.g., "I know you've got this.").
-
-        User Goal: {goal}
-        Relevant Gold Standards: {', '.join(relevant_standards)}
-        
-        **OUTPUT FORMAT:** HTML ONLY. Use <b>bold</b> and <br> for structure. NO markdown blocks.
-        """
+        relevant_standards = GOLD_STANDARDS.get(goal)
+        if relevant_standards is None:
+            relevant_standards = ', '.join(v for k, v in GOLD_STANDARDS.items() if k in goal)
+
+        # Static persona first (shared cached prefix), per-user goal last
+        system_prompt = f"{COACH_SYSTEM_PROMPT}\nUser Goal: {goal}\nRelevant Gold Standards: {relevant_standards}\n"
 
         try:
             response = self.client.chat.completions.create(
@@ -230,26 +587,20 @@ class SmartNLUEngine:
                     {"role": "user", "content": message}
                 ],
                 temperature=0.8,
-                max_tokens=1024
+                max_tokens=512
             )
             return response.choices[0].message.content
-        except:
+        except Exception as e:
+            logger.warning("Coach intervention error: %s", e)
             return f"I hear you, {name}. It's tough, but remember we're doing this for {goal}. Let's try to stick to the plan."
 
-    def generate_response(self, profile, message, intent):
+    def generate_response(self, profile, message, intent, entities=None):
         """
         Generates a natural language response based on the intent.
         Enforces modern, structured, and profile-aware formatting.
         """
         name = profile.get('name', 'Friend')
         goal = profile.get('goal', 'better health')
-        gender = profile.get('gender', 'Unknown')
-        level = profile.get('fitness_level', 'Beginner')
-        age = profile.get('age', 'Unknown')
-        weight = profile.get('weight', 'Unknown')
-        height = profile.get('height', 'Unknown')
-        bmi = profile.get('bmi', 'Unknown')
-        condition = profile.get('medical_conditions', 'None')
 
         # --- 1. HARD STOP FOR OUT OF SCOPE / GIBBERISH ---
         if intent == 'out_of_scope':
@@ -278,84 +629,48 @@ class SmartNLUEngine:
         </div>
         """
 
-        # Construct full context string safely
-        user_context = f"""
-        - Name: {name}
-        - Primary Goal: {goal}
-        - Gender: {gender}
-        - Fitness Level: {level}
-        - Age: {age}
-        - Weight: {weight} kg
-        - Height: {height} cm
-        - BMI: {bmi}
-        - Medical Conditions: {condition}
-        """
-
         # --- SPECIAL HANDLER: NUTRITION OPTIONS (CLARIFICATION) ---
         if intent == 'nutrition_options':
-            options = ["Breakfast", "Lunch", "Dinner", "Snack"]
+            buttons = NUTRITION_OPTIONS_HTML
             if 'Loss' in goal:
-                options = ["Breakfast", "Lunch", "Dinner", "Low Calorie"]
+                buttons = NUTRITION_OPTIONS_LOSS_HTML
                 intro = f"I'd love to help with your nutrition, {name}! Since your goal is <b>Weight Loss</b>, I can find meals that fit your calorie targets.<br><br><b>Which meal specifically do you need ideas for?</b>"
             else:
                 intro = f"I can certainly help with meal ideas, {name}! To give you the best recommendation for your goal, I need a little more detail.<br><br><b>Which meal time are you looking for?</b>"
 
-            html = '<div class="flex flex-wrap gap-2 mt-3">'
-            for opt in options:
-                html += f"""<button onclick="sendQuick('{opt} ideas')" class="px-4 py-2 bg-brand-50 text-brand-600 rounded-full text-sm font-bold border border-brand-100 hover:bg-brand-600 hover:text-white transition-colors shadow-sm">{opt}</button>"""
-            html += '</div>'
-            return f"{intro}{html}"
+            return f"{intro}{buttons}"
 
         # --- LOGGING CONFIRMATION ---
         if intent in ['log_weight', 'log_nutrition', 'log_workout', 'view_progress']:
-            return self._format_log_confirmation(intent, entities)
+            return format_log_confirmation(intent.replace('log_', ''), entities or {})
 
         # --- COACH CHALLENGE INTERVENTION ---
         if intent == 'coach_challenge':
             return self._get_coach_intervention(message, profile)
 
         # --- GENERAL CHAT & EXPLANATIONS (Modern Chatbot Style) ---
-        system_prompt = f"""
-        You are Atlas, an Empathetic Performance Coach.
-        
-        **USER PROFILE (USE THIS DATA FOR ALL CALCULATIONS!):**
-        {user_context}
-        
-        **CRITICAL RESPONSE RULES (READ CAREFULLY!):**
-        1. **ONLY answer what was asked** - Do NOT volunteer extra information!
-        2. **For simple messages (greetings, thanks, acknowledgments):** Give a SHORT 1-2 sentence response. Do NOT provide unsolicited advice or workout plans!
-        3. **MAX LENGTH: 50-100 words** for simple chats, up to 150 words ONLY if explaining something complex.
-        4. **NO UNPROMPTED ADVICE** - If user says "thank you", just say "You're welcome!" - do NOT give workout plans!
-        
-        **EXAMPLES OF CORRECT RESPONSES:**
-        - User: "Thank you" → "You're welcome! Let me know if you need anything else. 💪"
-        - User: "Hi Atlas" → "Hey there! How can I help with your fitness journey today?"
-        - User: "Ok thanks" → "Anytime! I'm here when you need me."
-        
-        **FORMATTING RULES:**
-        1. **Use HTML tags** - Use <b>bold</b> for emphasis. Use <br> for line breaks SPARINGLY.
-        2. **NO EXCESSIVE SPACING** - Maximum 1 <br> between sections.
-        3. **Bullet lists:** Use plain dashes (-) or bullets (•). Keep them tight.
-        4. **NO MARKDOWN** - Don't use **, ##, or ``` - use HTML only.
-        
-        **FOR QUESTIONS THAT NEED ANSWERS:**
-        1. **Start with a direct answer** - no fluffy introductions.
-        2. **Use Profile Data:** For BMI/weight questions, CALCULATE using EXACT numbers from profile.
-        3. **BMI Formula:** BMI = weight(kg) / (height(m))^2
-        4. **Tone:** Professional, encouraging. Use "We" language.
-        
-        **FOR EXERCISE EXPLANATIONS (ONLY if asked!):**
-        <b>[Exercise Name]</b><br>
-        • [Key point 1]<br>
-        • [Key point 2]<br>
-        • [Key point 3]<br>
-        <b>Tip:</b> [One common mistake to avoid]
-        
-        - ONLY 3-4 bullet points maximum
-        - NO lengthy introductions or conclusions
-        - If YouTube link requested: <br><a href="https://www.youtube.com/results?search_query=[EXERCISE]+tutorial" target="_blank" class="inline-flex items-center gap-2 px-4 py-2 bg-red-600 hover:bg-red-700 text-white rounded-lg font-bold transition-colors"><i class="fab fa-youtube"></i> Watch Tutorial</a>
+        # Construct full context string safely (only the LLM path below needs it)
+        user_context = f"""
+        - Name: {name}
+        - Primary Goal: {goal}
+        - Gender: {profile.get('gender', 'Unknown')}
+        - Fitness Level: {profile.get('fitness_level', 'Beginner')}
+        - Age: {profile.get('age', 'Unknown')}
+        - Weight: {profile.get('weight', 'Unknown')} kg
+        - Height: {profile.get('height', 'Unknown')} cm
+        - BMI: {profile.get('bmi', 'Unknown')}
+        - Medical Conditions: {profile.get('medical_conditions', 'None')}
         """
 
+        # Static rules first (shared cached prefix), per-user profile last
+        system_prompt = f"{RESPONSE_SYSTEM_PROMPT}\n**USER PROFILE (USE THIS DATA FOR ALL CALCULATIONS!):**\n{user_context}"
+
+        # The reply only depends on the profile context and the message, so repeats are served from cache
+        cache_key = (user_context, cache_text(message))
+        with self._cache_lock:
+            cached = self._reply_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
         try:
             response = self.client.chat.completions.create(
@@ -365,58 +680,38 @@ class SmartNLUEngine:
                     {"role": "user", "content": message}
                 ],
                 temperature=0.4,
-                max_tokens=2048
+                max_tokens=600  # prompt caps answers at ~150 words plus HTML
             )
             content = response.choices[0].message.content
             if not content:
                 return "I'm here listening! How can I help you with your fitness journey today?"
+            with self._cache_lock:
+                self._reply_cache[cache_key] = content
             return content
 
-        except Exception:
+        except Exception as e:
+            logger.warning("Response generation error: %s", e)
             return "I'm having a little trouble thinking right now. Could you ask that again?"
 
     def generate_recipe(self, food_name, profile):
         """
         Generates a formatted recipe card.
         """
-        diet = "general"
-        if 'Loss' in profile.get('goal', ''): diet = "low calorie, high volume"
-        if 'Muscle' in profile.get('goal', ''): diet = "high protein"
-
-        system_prompt = f"""
-        You are a Michelin-star fitness chef.
-        Task: Create a healthy, delicious recipe for: "{food_name}".
-        Context: The user is on a **{diet}** diet.
-
-        **OUTPUT FORMAT (HTML ONLY):**
-        Return the raw HTML inside a `<div>`. Do not use markdown blocks.
-
-        Structure & Design (Use Tailwind Classes for light/dark mode):
-
-        1. **Recipe Header:**
-           - Use a `<div>` with `p-6 bg-slate-50 dark:bg-slate-900 border-b border-slate-100 dark:border-slate-700`.
-           - Title `<h3>` with `text-2xl font-black text-slate-800 dark:text-white mb-2 flex items-center gap-2`. Start with a relevant emoji.
-           - Description `<p>` with `text-sm text-slate-500 dark:text-slate-400 italic`.
-
-        2. **Ingredients Section:**
-           - Use a `<div>` with `p-6 bg-white dark:bg-slate-800`.
-           - Header `<h4>` with `font-bold text-slate-700 dark:text-slate-200 uppercase tracking-wider text-xs mb-4 flex items-center gap-2`. Use `<i class="fas fa-shopping-basket text-brand-500"></i>`.
-           - List `<ul>` with `space-y-2`.
-           - Items `<li>` with `flex items-start gap-2 text-sm text-slate-600 dark:text-slate-300`. Use `<span class="text-brand-500 font-bold">•</span>` as bullet.
-
-        3. **Instructions Section:**
-           - Use a `<div>` with `p-6 pt-0 bg-white dark:bg-slate-800`.
-           - Header `<h4>` with `font-bold text-slate-700 dark:text-slate-200 uppercase tracking-wider text-xs mb-4 flex items-center gap-2`. Use `<i class="fas fa-list-ol text-brand-500"></i>`.
-           - List `<ol>` with `space-y-4`.
-           - Items `<li>` with `flex gap-3 text-sm text-slate-600 dark:text-slate-300`. Use `<span class="w-6 h-6 rounded-full bg-brand-100 dark:bg-brand-900/30 text-brand-600 dark:text-brand-400 text-xs font-bold flex items-center justify-center shrink-0">1</span>` for numbered circles.
-
-        4. **Chef's Tip (at the end):**
-           - Use a `<div>` with `mx-6 mb-6 p-4 bg-emerald-50 dark:bg-emerald-900/20 text-emerald-700 dark:text-emerald-300 rounded-xl text-sm border border-emerald-100 dark:border-emerald-800/30 flex gap-3 items-start`.
-           - Icon: `<i class="fas fa-lightbulb text-emerald-500 mt-0.5"></i>`.
-           - Content: `<span><b class="text-emerald-700 dark:text-emerald-300">Chef's Tip:</b> ...</span>`.
-
-        IMPORTANT: Output ONLY the HTML. No markdown, no explanation.
-        """
+        goal = profile.get('goal') or ''
+        diet = GOAL_DIET.get(goal)
+        if diet is None:
+            # Free-text goals: keyword match, muscle taking precedence as before
+            diet = "high protein" if 'Muscle' in goal else "low calorie, high volume" if 'Loss' in goal else "general"
+
+        # A recipe only depends on the dish and the diet, so popular ones are generated once
+        cache_key = (cache_text(food_name), diet)
+        with self._cache_lock:
+            cached = self._recipe_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Static format spec first (shared cached prefix), the dish and diet last
+        system_prompt = f'{RECIPE_SYSTEM_PROMPT}\nTask: Create a healthy, delicious recipe for: "{food_name}".\nContext: The user is on a **{diet}** diet.\n'
 
         try:
             response = self.client.chat.completions.create(
@@ -428,6 +723,11 @@ class SmartNLUEngine:
                 temperature=0.5,
                 max_tokens=2048
             )
-            return response.choices[0].message.content
-        except Exception:
+            content = response.choices[0].message.content
+            if content:
+                with self._cache_lock:
+                    self._recipe_cache[cache_key] = content
+            return content
+        except Exception as e:
+            logger.warning("Recipe generation error: %s", e)
             return "<div class='text-red-500 font-bold p-6 text-center'>The chef is currently busy. Please try again in a moment!</div>"
@@ -1,16 +1,37 @@
 import firebase_admin
 from firebase_admin import firestore
 from google.cloud.firestore import FieldFilter
+import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import random
 
 
+def _text_column(df, col):
+    """Lowercased string view of a DataFrame column ('' where the column is missing)."""
+    if col not in df:
+        return pd.Series('', index=df.index)
+    return df[col].map(str).str.lower()
+
+
+def _contains_count(texts, terms):
+    """Per-row count of how many of the (lowercase) terms occur as substrings."""
+    counts = np.zeros(len(texts))
+    for term in terms:
+        counts += texts.str.contains(term, regex=False).to_numpy()
+    return counts
+
+
+def _top_k_order(scores, k):
+    """Row positions of the k best scores, best first (ties keep original order)."""
+    return np.argsort(-scores, kind='stable')[:k]
+
+
 class ContentBasedRecommender:
-    def __init__(self):
-        # Assumes firebase_admin is initialized externally
-        self.db = firestore.client()
+    def __init__(self, db_client=None):
+        # Reuse the app's Firestore client; assumes firebase_admin is initialized externally otherwise
+        self.db = db_client or firestore.client()
         
         # Gold Standards for Effectiveness
         self.GOLD_STANDARDS = {
@@ -44,8 +65,8 @@ class ContentBasedRecommender:
         """
         if target and isinstance(target, str): target = target.title()
 
-        # Ensure ignore_list is clean and normalized for robust comparison
-        clean_ignore_list = [str(x).strip().lower() for x in ignore_list if x]
+        # Ensure ignore_list is clean and normalized for robust comparison (a set: only used for membership tests)
+        clean_ignore_list = {str(x).strip().lower() for x in ignore_list if x}
         clean_likes = [str(x).strip().lower() for x in likes if x]
         clean_dislikes = [str(x).strip().lower() for x in dislikes if x]
 
@@ -208,53 +229,33 @@ class ContentBasedRecommender:
                     if goal_key in user_goal:
                         gold_standards.extend(keywords)
 
-                final_scores = []
-                for idx, cosine_score in enumerate(base_scores):
-                    row = df.iloc[idx]
-                    title = str(row.get('Title', '')).lower()
-                    desc = str(row.get('Desc', '')).lower()
-                    bodypart = str(row.get('Bodypart', '')).lower()
-                    
-                    combined_text = f"{title} {desc} {bodypart}"
+                # Scored column-wise over all candidates at once
+                titles = _text_column(df, 'Title')
+                equipment = _text_column(df, 'Equipment')
+                combined_text = titles + " " + _text_column(df, 'Desc') + " " + _text_column(df, 'Bodypart')
 
-                    # 1. Calculate Effectiveness Score (0 to 1)
-                    # Count how many Gold Standard keywords match
-                    match_count = sum(1 for ks in gold_standards if ks.lower() in combined_text)
-                    # Normalize: 0 to 1 (capped at 3 matches for max effectiveness)
-                    effectiveness = min(1.0, match_count / 3.0) 
-                    
-                    # Gold Standard Boost (Even if not liked)
-                    if match_count > 0:
-                        effectiveness += 0.4 
-                    effectiveness = min(1.0, effectiveness)
-
-                    # 2. Calculate Preference Score (0 to 1)
-                    # Cosine score is our baseline preference from TF-IDF query
-                    # Additionally boost if user specifically "liked" this item
-                    
-                    # Get equipment field for matching
-                    equipment = str(row.get('Equipment', '')).lower()
-                    
-                    # Check if any preference matches title OR equipment (with fuzzy matching for plurals)
-                    has_preference_match = any(
-                        good in title or good in equipment or  # Direct match
-                        good.rstrip('s') in title or good.rstrip('s') in equipment  # Singular form (dumbbells -> dumbbell)
-                        for good in likes
-                    )
-                    
-                    # Debug logging for preference matching
-                    if likes:
-                        print(f"[Recommender] Preference check - Title: '{title[:30]}', Equipment: '{equipment}', Likes: {likes}, Match: {has_preference_match}")
-                    
-                    preference_boost = 0.3 if has_preference_match else 0
-                    user_pref = min(1.0, cosine_score + preference_boost)
+                # 1. Effectiveness Score (0 to 1)
+                # Count how many Gold Standard keywords match, normalized (capped at 3 matches),
+                # plus a Gold Standard boost even if not liked
+                match_count = _contains_count(combined_text, [ks.lower() for ks in gold_standards])
+                effectiveness = np.minimum(1.0, match_count / 3.0 + np.where(match_count > 0, 0.4, 0.0))
 
-                    # 3. Final Formula: (Eff * 0.7) + (Pref * 0.3)
-                    final_score = (effectiveness * 0.7) + (user_pref * 0.3)
-                    final_scores.append(final_score)
+                # 2. Preference Score (0 to 1)
+                # Cosine score is our baseline preference from TF-IDF query, boosted if any
+                # preference matches title OR equipment (singular form too: dumbbells -> dumbbell)
+                pref_terms = {t for good in likes for t in (good, good.rstrip('s'))}
+                has_preference_match = (_contains_count(titles, pref_terms) + _contains_count(equipment, pref_terms)) > 0
+
+                if likes:
+                    print(f"[Recommender] Preference check - Likes: {likes}, Matches: {int(has_preference_match.sum())}/{len(df)}")
+
+                user_pref = np.minimum(1.0, base_scores + np.where(has_preference_match, 0.3, 0.0))
+
+                # 3. Final Formula: (Eff * 0.7) + (Pref * 0.3)
+                final_scores = (effectiveness * 0.7) + (user_pref * 0.3)
 
                 df['score'] = final_scores
-                df = df.sort_values(by='score', ascending=False)
+                df = df.iloc[_top_k_order(final_scores, top_k)]
             except Exception as e:
                 print(f"TF-IDF Error: {e}")
                 pass
@@ -350,47 +351,36 @@ class ContentBasedRecommender:
                     if goal_key in user_goal:
                         gold_standards.extend(keywords)
 
-                final_scores = []
-                for idx, cosine_score in enumerate(base_scores):
-                    row = df.iloc[idx]
-                    name = str(row.get('Name', '')).lower()
-                    cat = str(row.get('Category', '')).lower()
-                    
-                    combined_text = f"{name} {cat}"
+                names = _text_column(df, 'Name')
+                cats = _text_column(df, 'Category')
 
-                    # 1. Effectiveness Score
-                    match_count = sum(1 for ks in gold_standards if ks.lower() in combined_text)
-                    # Special check for macros if available in gold standards logic
-                    if 'High Protein' in gold_standards and int(row.get('Protein', 0)) > 20: match_count += 2
-                    if 'Fiber-rich' in gold_standards and 'Salad' in cat: match_count += 1
-                    
-                    effectiveness = min(1.0, match_count / 3.0)
-                    
-                    # Gold Standard Boost
-                    if match_count > 0:
-                        effectiveness += 0.4
-                    effectiveness = min(1.0, effectiveness)
-
-                    # 2. Preference Score
-                    # Check if any preference matches food name (with fuzzy matching for plurals)
-                    has_preference_match = any(
-                        good in name or good.rstrip('s') in name  # Direct or singular match
-                        for good in likes
-                    )
-                    
-                    # Debug logging for nutrition preference matching
-                    if likes:
-                        print(f"[Recommender] Nutrition preference check - Name: '{name[:30]}', Likes: {likes}, Match: {has_preference_match}")
-                    
-                    preference_boost = 0.3 if has_preference_match else 0
-                    user_pref = min(1.0, cosine_score + preference_boost)
+                # 1. Effectiveness Score
+                match_count = _contains_count(names + " " + cats, [ks.lower() for ks in gold_standards])
+                # Special check for macros if available in gold standards logic
+                if 'High Protein' in gold_standards and 'Protein' in df:
+                    protein = pd.to_numeric(df['Protein'], errors='coerce').fillna(0).to_numpy()
+                    match_count += np.where(np.trunc(protein) > 20, 2, 0)
+                if 'Fiber-rich' in gold_standards:
+                    match_count += cats.str.contains('salad', regex=False).to_numpy()
+
+                # Gold Standard Boost
+                effectiveness = np.minimum(1.0, match_count / 3.0 + np.where(match_count > 0, 0.4, 0.0))
+
+                # 2. Preference Score
+                # Check if any preference matches food name (with fuzzy matching for plurals)
+                pref_terms = {t for good in likes for t in (good, good.rstrip('s'))}
+                has_preference_match = _contains_count(names, pref_terms) > 0
+
+                if likes:
+                    print(f"[Recommender] Nutrition preference check - Likes: {likes}, Matches: {int(has_preference_match.sum())}/{len(df)}")
+
+                user_pref = np.minimum(1.0, base_scores + np.where(has_preference_match, 0.3, 0.0))
 
-                    # 3. Final Formula
-                    final_score = (effectiveness * 0.7) + (user_pref * 0.3)
-                    final_scores.append(final_score)
+                # 3. Final Formula
+                final_scores = (effectiveness * 0.7) + (user_pref * 0.3)
 
                 df['score'] = final_scores
-                df = df.sort_values(by='score', ascending=False)
+                df = df.iloc[_top_k_order(final_scores, top_k)]
             except Exception as e:
                 print(f"Nutrition TF-IDF Error: {e}")
                 pass
@@ -1,3 +1,23 @@
+import re
+
+# Injury-to-exercise risk mappings (condition word -> risky title/description terms)
+RISK_KEYWORDS = {
+    'knee': ('squat', 'lunge', 'leg press', 'jump', 'run', 'plyo'),
+    'back': ('deadlift', 'good morning', 'bent over', 'back extension'),
+    'shoulder': ('overhead press', 'snatch', 'handstand', 'bench press'),
+    'wrist': ('push-up', 'handstand', 'clean', 'front rack')
+}
+
+# Conditions match at the start of a word: "knees", "backache", "kneecap" count, "feedback" doesn't
+CONDITION_RES = {condition: re.compile(r'\b' + condition) for condition in RISK_KEYWORDS}
+
+
+def active_conditions(medical_conditions_str):
+    """RISK_KEYWORDS conditions mentioned in the free-text medical conditions."""
+    text = medical_conditions_str.lower()
+    return {condition for condition, pattern in CONDITION_RES.items() if pattern.search(text)}
+
+
 class SafetyValidator:
     @staticmethod
     def validate_request(user_profile):
@@ -63,18 +83,12 @@ class SafetyValidator:
         if not medical_conditions_str:
             return exercises_list, []
 
-        conditions = medical_conditions_str.lower()
+        conditions = active_conditions(medical_conditions_str)
+        active_risks = [(condition, terms) for condition, terms in RISK_KEYWORDS.items() if condition in conditions]
+        knee_issue = 'knee' in conditions
         warnings = []
         safe_exercises = []
 
-        # Define injury-to-exercise risk mappings
-        risk_keywords = {
-            'knee': ['squat', 'lunge', 'leg press', 'jump', 'run', 'plyo'],
-            'back': ['deadlift', 'good morning', 'bent over', 'back extension'],
-            'shoulder': ['overhead press', 'snatch', 'handstand', 'bench press'],
-            'wrist': ['push-up', 'handstand', 'clean', 'front rack']
-        }
-
         for exercise in exercises_list:
             ex_title = exercise.get('Title', '').lower()
             ex_desc = exercise.get('Desc', '').lower()
@@ -83,18 +97,17 @@ class SafetyValidator:
             is_unsafe = False
 
             # Check each condition the user has
-            for condition, risky_terms in risk_keywords.items():
-                if condition in conditions:
-                    for risky_word in risky_terms:
-                        if risky_word in ex_title or risky_word in ex_desc:
-                            is_unsafe = True
-                            warnings.append(f"Removed '{ex_title}' due to {condition} condition")
-                            break
+            for condition, risky_terms in active_risks:
+                for risky_word in risky_terms:
+                    if risky_word in ex_title or risky_word in ex_desc:
+                        is_unsafe = True
+                        warnings.append(f"Removed '{ex_title}' due to {condition} condition")
+                        break
                 if is_unsafe:
                     break
 
             # Additional rule: High impact for knee issues
-            if 'knee' in conditions and ex_type == 'plyometrics':
+            if knee_issue and ex_type == 'plyometrics':
                 is_unsafe = True
                 warnings.append(f"Removed plyometric '{ex_title}' for knee safety")
 
@@ -107,57 +120,3 @@ class SafetyValidator:
             warnings.append("OVERFILTER WARNING: All exercises flagged. Showing one with caution.")
 
         return safe_exercises, warnings
-
-    # Add to your existing SafetyValidator class in safety_validator.py
-    def filter_exercises_for_injuries(self, exercises_list, medical_conditions_str):
-        """
-        Filters out unsafe exercises based on medical conditions.
-        Returns: (filtered_list, warnings)
-        """
-        if not medical_conditions_str:
-            return exercises_list, []
-
-        conditions = medical_conditions_str.lower()
-        warnings = []
-        safe_exercises = []
-
-        # Define injury-to-exercise risk mappings
-        risk_keywords = {
-            'knee': ['squat', 'lunge', 'leg press', 'jump', 'run', 'plyo'],
-            'back': ['deadlift', 'good morning', 'bent over', 'back extension'],
-            'shoulder': ['overhead press', 'snatch', 'handstand', 'bench press'],
-            'wrist': ['push-up', 'handstand', 'clean', 'front rack']
-        }
-
-        for exercise in exercises_list:
-            ex_title = exercise.get('Title', '').lower()
-            ex_desc = exercise.get('Desc', '').lower()
-            ex_type = exercise.get('Type', '').lower()
-
-            is_unsafe = False
-
-            # Check each condition the user has
-            for condition, risky_terms in risk_keywords.items():
-                if condition in conditions:
-                    for risky_word in risky_terms:
-                        if risky_word in ex_title or risky_word in ex_desc:
-                            is_unsafe = True
-                            warnings.append(f"Removed '{ex_title}' due to {condition} condition")
-                            break
-                if is_unsafe:
-                    break
-
-            # Additional rule: High impact for knee issues
-            if 'knee' in conditions and ex_type == 'plyometrics':
-                is_unsafe = True
-                warnings.append(f"Removed plyometric '{ex_title}' for knee safety")
-
-            if not is_unsafe:
-                safe_exercises.append(exercise)
-
-        # If we filtered EVERYTHING, return at least the first one with a warning
-        if not safe_exercises and exercises_list:
-            safe_exercises = [exercises_list[0]]
-            warnings.append("OVERFILTER WARNING: All exercises flagged. Showing one with caution.")
-
-        return safe_exercises, warnings
\ No newline at end of file
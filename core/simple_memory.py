@@ -19,6 +19,24 @@ class SimpleMemory:
         except Exception as e:
             print(f"Memory Log Error: {e}")
 
+    def log_interactions(self, user_id, item_titles, category):
+        """Logs every item shown in one response with a single batch commit."""
+        if not self.db or not item_titles: return
+
+        try:
+            recent_ref = self.db.collection('users').document(user_id).collection('recent_recommendations')
+            now = datetime.now()
+            batch = self.db.batch()
+            for item_title in item_titles:
+                batch.set(recent_ref.document(), {
+                    'title': item_title,
+                    'category': category,  # 'exercises' or 'foods'
+                    'timestamp': now
+                })
+            batch.commit()
+        except Exception as e:
+            print(f"Memory Log Error: {e}")
+
     def get_recent_items(self, user_id, category, limit=20):
         """Retrieves recently recommended items to filter them out."""
         if not self.db: return []
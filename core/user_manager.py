@@ -2,21 +2,31 @@ import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
 import os
+import copy
 import datetime
 import logging
+import threading
+import redis
+from cachetools import TTLCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Per-user write generation shared by all workers (bumped on every profile write)
+USER_GENERATION_KEY = 'atlas:user_gen:{}'
+USER_GENERATION_TTL = 86400  # seconds; far longer than any cached profile lives
+
 
 class UserManager:
-    def __init__(self, key_path=None):
+    def __init__(self, key_path=None, db_client=None, redis_url=None):
         """
         Initialize the UserManager with Firebase Firestore connection.
-        If key_path is not provided, it looks for 'serviceAccountKey.json' in the project root.
+        Reuses db_client when given; otherwise initializes Firebase from key_path
+        (defaulting to 'serviceAccountKey.json' in the project root).
+        With redis_url, profile writes are versioned in Redis so every worker drops stale cache entries.
         """
-        if not firebase_admin._apps:
+        if db_client is None and not firebase_admin._apps:
             # Determine path to service account key if not provided
             if key_path is None:
                 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -28,28 +38,111 @@ class UserManager:
                     firebase_admin.initialize_app(cred)
                     logger.info("Firebase initialized successfully.")
                 except Exception as e:
-                    logger.error(f"Failed to initialize Firebase: {e}")
+                    logger.error("Failed to initialize Firebase: %s", e)
             else:
-                logger.warning(f"Service account key not found at {key_path}. Firestore features will be disabled.")
+                logger.warning("Service account key not found at %s. Firestore features will be disabled.", key_path)
+
+        self.db = db_client or (firestore.client() if firebase_admin._apps else None)
 
-        self.db = firestore.client() if firebase_admin._apps else None
+        # Per-process profile cache (profiles are read on every chat turn, written rarely).
+        # Entries are {'generation': ..., 'profiles': {fields_tuple_or_None: profile_dict}} and are
+        # only served while their generation is still current. Only enabled with Redis: without a
+        # shared generation a write on one gunicorn worker can't invalidate the others.
+        self._user_cache = TTLCache(maxsize=10_000, ttl=60)
+        self._user_cache_lock = threading.Lock()
+        self._local_generations = {}
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5) if redis_url else None
 
     def get_user(self, user_id):
-        """Retrieves user profile data from Firestore."""
+        """Retrieves user profile data from Firestore (served from a 60s cache when Redis is configured)."""
+        return self._get_cached_user(user_id, None)
+
+    def get_user_fields(self, user_id, fields):
+        """
+        Retrieves only the given profile fields, using a Firestore projection so the
+        rest of the document is never transferred.
+        """
+        return self._get_cached_user(user_id, tuple(fields))
+
+    def _generation(self, user_id):
+        """
+        Current write generation of a user: (local, shared Redis counter).
+        Returns None without Redis or when it is unreachable, meaning "don't use the cache".
+        """
+        if self._redis is None:
+            return None
+        with self._user_cache_lock:
+            local = self._local_generations.get(user_id, 0)
+        try:
+            shared = self._redis.get(USER_GENERATION_KEY.format(user_id))
+        except redis.RedisError as e:
+            logger.warning("Profile generation lookup failed for %s: %s", user_id, e)
+            return None
+        return local, int(shared or 0)
+
+    def _get_cached_user(self, user_id, fields):
+        """Serves a cached profile (or projection) if no write has happened since it was read."""
         if not self.db:
             return None
 
+        generation = self._generation(user_id)
+        cached = None
+        if generation is not None:
+            with self._user_cache_lock:
+                entry = self._user_cache.get(user_id)
+                if entry is not None and entry['generation'] == generation:
+                    profiles = entry['profiles']
+                    cached = profiles.get(fields)
+                    if cached is None and fields is not None and None in profiles:
+                        # A cached full document can answer any projection
+                        full = profiles[None]
+                        cached = {k: full[k] for k in fields if k in full}
+        if cached is not None:
+            return copy.copy(cached)
+
         try:
             doc_ref = self.db.collection('users').document(user_id)
-            doc = doc_ref.get()
+            doc = doc_ref.get(field_paths=list(fields)) if fields is not None else doc_ref.get()
             if doc.exists:
-                return doc.to_dict()
+                profile = doc.to_dict()
+                if generation is not None:
+                    self._store_user(user_id, fields, profile, generation)
+                return copy.copy(profile)
             else:
                 return None
         except Exception as e:
-            logger.error(f"Error fetching user {user_id}: {e}")
+            logger.error("Error fetching user %s: %s", user_id, e)
             return None
 
+    def _store_user(self, user_id, fields, profile, generation):
+        """Caches a profile read under the generation observed before the read started."""
+        with self._user_cache_lock:
+            # A local write during the read: this document may predate it, so don't cache it.
+            # (A write on another worker bumps the shared counter and fails the next read's check.)
+            if self._local_generations.get(user_id, 0) != generation[0]:
+                return
+            entry = self._user_cache.get(user_id)
+            if entry is None or entry['generation'] != generation:
+                entry = {'generation': generation, 'profiles': {}}
+                self._user_cache[user_id] = entry
+            entry['profiles'][fields] = profile
+
+    def invalidate_user(self, user_id):
+        """Drops the cached profile in this worker and, with Redis, in every other worker too."""
+        with self._user_cache_lock:
+            self._user_cache.pop(user_id, None)
+            self._local_generations[user_id] = self._local_generations.get(user_id, 0) + 1
+
+        if self._redis is not None:
+            key = USER_GENERATION_KEY.format(user_id)
+            try:
+                pipe = self._redis.pipeline()
+                pipe.incr(key)
+                pipe.expire(key, USER_GENERATION_TTL)
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning("Profile generation bump failed for %s: %s", user_id, e)
+
     def create_or_update_user(self, user_id, user_data):
         """
         Creates or updates a user document.
@@ -62,10 +155,11 @@ class UserManager:
             doc_ref = self.db.collection('users').document(user_id)
             # Merge=True ensures we don't overwrite existing fields unless specified
             doc_ref.set(user_data, merge=True)
-            logger.info(f"User {user_id} updated successfully.")
+            self.invalidate_user(user_id)
+            logger.info("User %s updated successfully.", user_id)
             return True
         except Exception as e:
-            logger.error(f"Error updating user {user_id}: {e}")
+            logger.error("Error updating user %s: %s", user_id, e)
             return False
 
     def log_interaction(self, user_id, message, response, intent=None):
@@ -83,7 +177,7 @@ class UserManager:
             # Add to a subcollection 'history' under the user
             self.db.collection('users').document(user_id).collection('history').add(interaction)
         except Exception as e:
-            logger.error(f"Error logging interaction for {user_id}: {e}")
+            logger.error("Error logging interaction for %s: %s", user_id, e)
 
     def get_user_history(self, user_id, limit=5):
         """Retrieves the last N interactions for context."""
@@ -102,7 +196,7 @@ class UserManager:
             # Return in chronological order (oldest to newest)
             return history[::-1]
         except Exception as e:
-            logger.error(f"Error fetching history for {user_id}: {e}")
+            logger.error("Error fetching history for %s: %s", user_id, e)
             return []
 
     # ============================================
@@ -119,7 +213,7 @@ class UserManager:
 
         try:
             # Get user profile to retrieve height if not provided
-            profile = self.get_user(user_id) or {}
+            profile = self.get_user_fields(user_id, ('height',)) or {}
             if height is None:
                 height = profile.get('height')
 
@@ -145,11 +239,11 @@ class UserManager:
                 profile_update['bmi'] = bmi
             self.create_or_update_user(user_id, profile_update)
 
-            logger.info(f"Weight log added for user {user_id}: {weight}kg, BMI: {bmi}")
+            logger.info("Weight log added for user %s: %skg, BMI: %s", user_id, weight, bmi)
             return {'weight': weight, 'bmi': bmi}
 
         except Exception as e:
-            logger.error(f"Error adding weight log for {user_id}: {e}")
+            logger.error("Error adding weight log for %s: %s", user_id, e)
             return None
 
     def get_weight_logs(self, user_id, days=7):
@@ -159,8 +253,9 @@ class UserManager:
 
         try:
             logs_ref = self.db.collection('users').document(user_id).collection('weight_logs')
-            # Get all recent logs without complex timestamp filtering
-            query = logs_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(30)
+            # Most recent N logs without complex timestamp filtering
+            query = logs_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(days)
+            today = datetime.datetime.now().strftime('%Y-%m-%d')
 
             logs = []
             for doc in query.stream():
@@ -176,7 +271,7 @@ class UserManager:
                     else:
                         date_str = str(timestamp)[:10]
                 else:
-                    date_str = datetime.datetime.now().strftime('%Y-%m-%d')
+                    date_str = today
                 
                 logs.append({
                     'date': date_str,
@@ -185,10 +280,10 @@ class UserManager:
                     'timestamp': timestamp
                 })
 
-            # Return only last N days worth, in chronological order
-            return logs[:days][::-1]
+            # Return in chronological order
+            return logs[::-1]
         except Exception as e:
-            logger.error(f"Error fetching weight logs for {user_id}: {e}")
+            logger.error("Error fetching weight logs for %s: %s", user_id, e)
             return []
 
     def add_nutrition_log(self, user_id, calories=None, protein=None, carbs=None, fat=None):
@@ -200,7 +295,8 @@ class UserManager:
             return None
 
         try:
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
+            now = datetime.datetime.now()
+            today = now.strftime('%Y-%m-%d')
             doc_ref = self.db.collection('users').document(user_id).collection('nutrition_logs').document(today)
 
             # Get existing data for today
@@ -211,7 +307,7 @@ class UserManager:
                 existing = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0, 'entries': []}
 
             # Add new values (cumulative)
-            new_entry = {'timestamp': datetime.datetime.now().isoformat()}
+            new_entry = {'timestamp': now.isoformat()}
             if calories is not None:
                 existing['calories'] = existing.get('calories', 0) + calories
                 new_entry['calories'] = calories
@@ -230,16 +326,16 @@ class UserManager:
             entries.append(new_entry)
             existing['entries'] = entries
             existing['date'] = today
-            existing['last_updated'] = datetime.datetime.now()
+            existing['last_updated'] = now
 
             # Save to Firestore
             doc_ref.set(existing)
 
-            logger.info(f"Nutrition log updated for user {user_id} on {today}")
+            logger.info("Nutrition log updated for user %s on %s", user_id, today)
             return existing
 
         except Exception as e:
-            logger.error(f"Error adding nutrition log for {user_id}: {e}")
+            logger.error("Error adding nutrition log for %s: %s", user_id, e)
             return None
 
     def get_today_nutrition(self, user_id):
@@ -259,7 +355,7 @@ class UserManager:
             return default_data
 
         except Exception as e:
-            logger.error(f"Error fetching today's nutrition for {user_id}: {e}")
+            logger.error("Error fetching today's nutrition for %s: %s", user_id, e)
             return default_data
 
 
@@ -269,21 +365,26 @@ class UserManager:
             return []
 
         try:
+            today = datetime.datetime.now()
+            logs_ref = self.db.collection('users').document(user_id).collection('nutrition_logs')
+            doc_refs = [
+                logs_ref.document((today - datetime.timedelta(days=i)).strftime('%Y-%m-%d'))
+                for i in range(days)
+            ]
+
+            # One batched read instead of a round-trip per day (get_all does not preserve order)
             logs = []
-            for i in range(days):
-                date = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-                doc_ref = self.db.collection('users').document(user_id).collection('nutrition_logs').document(date)
-                doc = doc_ref.get()
+            for doc in self.db.get_all(doc_refs):
                 if doc.exists:
                     data = doc.to_dict()
-                    data['date'] = date
+                    data['date'] = doc.id
                     logs.append(data)
 
             # Return in chronological order
-            return logs[::-1]
+            return sorted(logs, key=lambda log: log['date'])
 
         except Exception as e:
-            logger.error(f"Error fetching nutrition logs for {user_id}: {e}")
+            logger.error("Error fetching nutrition logs for %s: %s", user_id, e)
             return []
 
     def add_workout_log(self, user_id, workout_name, exercises=None, duration=None):
@@ -295,9 +396,10 @@ class UserManager:
             return None
 
         try:
+            now = datetime.datetime.now()
             log_entry = {
-                'timestamp': datetime.datetime.now(),
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
+                'timestamp': now,
+                'date': now.strftime('%Y-%m-%d'),
                 'workout_name': workout_name,
                 'exercises': exercises or [],
                 'duration': duration
@@ -306,11 +408,11 @@ class UserManager:
             # Add to workout_logs subcollection
             self.db.collection('users').document(user_id).collection('workout_logs').add(log_entry)
 
-            logger.info(f"Workout log added for user {user_id}: {workout_name}")
+            logger.info("Workout log added for user %s: %s", user_id, workout_name)
             return log_entry
 
         except Exception as e:
-            logger.error(f"Error adding workout log for {user_id}: {e}")
+            logger.error("Error adding workout log for %s: %s", user_id, e)
             return None
 
     def get_workout_logs(self, user_id, days=7):
@@ -320,8 +422,9 @@ class UserManager:
 
         try:
             logs_ref = self.db.collection('users').document(user_id).collection('workout_logs')
-            # Get all recent logs without complex timestamp filtering
-            query = logs_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(20)
+            # Most recent N logs without complex timestamp filtering
+            query = logs_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(days)
+            today = datetime.datetime.now().strftime('%Y-%m-%d')
 
             logs = []
             for doc in query.stream():
@@ -337,7 +440,7 @@ class UserManager:
                     else:
                         date_str = str(timestamp)[:10]
                 else:
-                    date_str = data.get('date', datetime.datetime.now().strftime('%Y-%m-%d'))
+                    date_str = data.get('date', today)
                 
                 logs.append({
                     'date': date_str,
@@ -347,11 +450,11 @@ class UserManager:
                     'timestamp': timestamp
                 })
 
-            # Return only last N days worth, in chronological order
-            return logs[:days][::-1]
+            # Return in chronological order
+            return logs[::-1]
 
         except Exception as e:
-            logger.error(f"Error fetching workout logs for {user_id}: {e}")
+            logger.error("Error fetching workout logs for %s: %s", user_id, e)
             return []
 
     # ============================================
@@ -376,10 +479,10 @@ class UserManager:
             item_data['item_type'] = item_type
             
             doc_ref.set(item_data, merge=True)
-            logger.info(f"Item '{item_name}' added to favorites for user {user_id}")
+            logger.info("Item '%s' added to favorites for user %s", item_name, user_id)
             return True
         except Exception as e:
-            logger.error(f"Error adding favorite for {user_id}: {e}")
+            logger.error("Error adding favorite for %s: %s", user_id, e)
             return False
 
     def get_favorites(self, user_id):
@@ -406,7 +509,7 @@ class UserManager:
                     
             return {'exercises': exercises, 'nutrition': nutrition}
         except Exception as e:
-            logger.error(f"Error fetching favorites for {user_id}: {e}")
+            logger.error("Error fetching favorites for %s: %s", user_id, e)
             return {'exercises': [], 'nutrition': []}
 
     def add_to_ignore_list(self, user_id, item_name):
@@ -425,11 +528,12 @@ class UserManager:
                     doc_ref.update({'ignore_list': ignore_list})
             else:
                 doc_ref.set({'ignore_list': [item_name.lower()]}, merge=True)
-                
-            logger.info(f"Item '{item_name}' added to ignore list for user {user_id}")
+            self.invalidate_user(user_id)
+
+            logger.info("Item '%s' added to ignore list for user %s", item_name, user_id)
             return True
         except Exception as e:
-            logger.error(f"Error adding to ignore list for {user_id}: {e}")
+            logger.error("Error adding to ignore list for %s: %s", user_id, e)
             return False
 
     # ============================================
@@ -440,17 +544,19 @@ class UserManager:
         """Logs a weight entry for the user."""
         if not self.db: return False
         try:
+            now = datetime.datetime.now()
             doc_ref = self.db.collection('users').document(user_id).collection('weight_logs').document()
             doc_ref.set({
                 'weight': float(weight),
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'timestamp': datetime.datetime.now()
+                'date': now.strftime('%Y-%m-%d'),
+                'timestamp': now
             })
             # Also update current profile weight
             self.db.collection('users').document(user_id).update({'weight': float(weight)})
+            self.invalidate_user(user_id)
             return True
         except Exception as e:
-            logger.error(f"Error logging weight: {e}")
+            logger.error("Error logging weight: %s", e)
             return False
 
     def log_nutrition(self, user_id, data):
@@ -458,12 +564,13 @@ class UserManager:
         if not self.db: return False
         try:
             doc_ref = self.db.collection('users').document(user_id).collection('nutrition_logs').document()
-            data['date'] = datetime.datetime.now().strftime('%Y-%m-%d')
-            data['timestamp'] = datetime.datetime.now()
+            now = datetime.datetime.now()
+            data['date'] = now.strftime('%Y-%m-%d')
+            data['timestamp'] = now
             doc_ref.set(data)
             return True
         except Exception as e:
-            logger.error(f"Error logging nutrition: {e}")
+            logger.error("Error logging nutrition: %s", e)
             return False
 
     def get_progress_logs(self, user_id, log_type='weight', days=7):
@@ -479,5 +586,5 @@ class UserManager:
             logs = [d.to_dict() for d in query.stream()]
             return logs
         except Exception as e:
-            logger.error(f"Error fetching progress logs: {e}")
+            logger.error("Error fetching progress logs: %s", e)
             return []
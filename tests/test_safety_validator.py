@@ -0,0 +1,48 @@
+import unittest
+
+from core.safety_validator import SafetyValidator, active_conditions
+
+
+EXERCISES = [
+    {'Title': 'Back Squat', 'Desc': '', 'Type': 'Strength'},
+    {'Title': 'Deadlift', 'Desc': '', 'Type': 'Strength'},
+    {'Title': 'Overhead Press', 'Desc': '', 'Type': 'Strength'},
+    {'Title': 'Bicep Curl', 'Desc': '', 'Type': 'Strength'},
+]
+
+
+def titles(medical_conditions):
+    safe, _ = SafetyValidator().filter_exercises_for_injuries(EXERCISES, medical_conditions)
+    return [exercise['Title'] for exercise in safe]
+
+
+class ActiveConditionsTest(unittest.TestCase):
+    def test_plain_and_plural_conditions(self):
+        self.assertEqual(active_conditions('Bad knees, sore shoulder'), {'knee', 'shoulder'})
+
+    def test_compound_conditions(self):
+        self.assertEqual(active_conditions('backache'), {'back'})
+        self.assertEqual(active_conditions('kneecap pain'), {'knee'})
+        self.assertEqual(active_conditions('shoulderblade injury'), {'shoulder'})
+
+    def test_word_inside_another_word_is_ignored(self):
+        self.assertEqual(active_conditions('feedback welcome'), set())
+
+
+class FilterExercisesForInjuriesTest(unittest.TestCase):
+    def test_backache_removes_deadlift(self):
+        self.assertEqual(titles('chronic backache'), ['Back Squat', 'Overhead Press', 'Bicep Curl'])
+
+    def test_kneecap_removes_squat(self):
+        self.assertEqual(titles('kneecap pain'), ['Deadlift', 'Overhead Press', 'Bicep Curl'])
+
+    def test_shoulderblade_removes_overhead_press(self):
+        self.assertEqual(titles('shoulderblade injury'), ['Back Squat', 'Deadlift', 'Bicep Curl'])
+
+    def test_no_conditions_keeps_everything(self):
+        self.assertEqual(titles(''), [e['Title'] for e in EXERCISES])
+        self.assertEqual(titles('feedback'), [e['Title'] for e in EXERCISES])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,14 @@ Production WSGI entry point for Atlas Chatbot.
 Use with Gunicorn or any WSGI server.
 
 Usage:
-    gunicorn -w 4 -b 0.0.0.0:8000 wsgi:app
+    gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:8000 wsgi:app
+
+Requests spend most of their time waiting on Firestore and OpenRouter, so
+threaded workers let each process serve several users while one is blocked
+on the network. gevent workers are not used: the Firestore client talks
+gRPC, which does not cooperate with gevent's monkey-patching without extra
+setup, and the app already relies on real threads (profile prefetch pool,
+journey-log writer).
 """
 
 from app import app